@@ -0,0 +1,54 @@
+# measures the cost of one pick from weighted alternations of different sizes
+#
+# usage:
+#     python benchmarks/alternation.py [--sizes <n>,...] [--picks <n>] [--engines <name>,...]
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pybnfuzzer
+
+# number of picks in every generated string
+PICKS_PER_STRING = 10
+
+
+def weighted_grammar(size: int) -> str:
+    variants = ' | '.join(f'{idx % 7 + 1}: "v{idx}"' for idx in range(size))
+    return f'<start> ::= {' '.join(['<choice>'] * PICKS_PER_STRING)} ;\n<choice> ::= {variants} ;\n'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser('alternation', description='benchmark weighted alternations')
+    parser.add_argument('--sizes', default='10,1000,100000', metavar='<n>,...')
+    parser.add_argument('--picks', type=int, default=200_000, metavar='<n>')
+    parser.add_argument('--engines', default='vm,flat,tree,python,numpy', metavar='<name>,...')
+    args = parser.parse_args()
+
+    engines = args.engines.split(',')
+    if 'numpy' in engines and importlib.util.find_spec('numpy') is None:
+        engines.remove('numpy')
+    count = args.picks // PICKS_PER_STRING
+    for size in map(int, args.sizes.split(',')):
+        bnf = weighted_grammar(size)
+        timings = []
+        for engine in engines:
+            # -O1 keeps the alternation, which -O2 could turn into a table
+            options = pybnfuzzer.EngineOptions(engine=engine, optimization_level=1)
+            start = time.perf_counter()
+            generator = pybnfuzzer.build_engine(pybnfuzzer.parse_bnf(bnf), options)
+            compiled = time.perf_counter() - start
+            context = pybnfuzzer.GenerationContext.from_seed(0)
+            start = time.perf_counter()
+            pybnfuzzer.write_many(generator, context, count, '\n', lambda _: None)
+            elapsed = time.perf_counter() - start
+            timings.append(f'{engine} {elapsed / (count * PICKS_PER_STRING) * 1e9:.0f} ns ({compiled:.2f} s to build)')
+        print(f'{size}-way: {', '.join(timings)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# measures how fast every engine generates strings from the same grammars
+#
+# usage:
+#     python benchmarks/generation.py [--count <n>] [--engines <name>,...] [--grammars <path>,...]
+
+import argparse
+import importlib.util
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pybnfuzzer
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), '..', 'examples')
+
+
+def layered_grammar(rules: int = 10, seed: int = 0) -> str:
+    # rules only refer to rules after them, so every expansion is finite,
+    # and there are no regexes, so the engines are measured on their own
+    rng = random.Random(seed)
+    lines = ['<start> ::= <rule-0> ;']
+    for idx in range(rules):
+        alternatives = []
+        for _ in range(rng.randint(2, 4)):
+            parts = []
+            for _ in range(rng.randint(1, 4)):
+                if idx + 1 < rules and rng.random() < 0.5:
+                    parts.append(f'<rule-{rng.randrange(idx + 1, rules)}>{rng.choice(("", "?", "*"))}')
+                else:
+                    parts.append(f'"{rng.choice(("a", "bc", "def", "+", "-"))}"')
+            alternatives.append(' '.join(parts))
+        lines.append(f'<rule-{idx}> ::= {' | '.join(alternatives)} ;')
+    return '\n'.join(lines) + '\n'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser('generation', description='benchmark string generation of every engine')
+    parser.add_argument('--count', type=int, default=100_000, metavar='<n>')
+    parser.add_argument('--engines', default='vm,flat,tree,python,numpy', metavar='<name>,...')
+    parser.add_argument('--grammars', default=os.path.join(EXAMPLES, 'postal.bnf'), metavar='<path>,...')
+    args = parser.parse_args()
+
+    engines = args.engines.split(',')
+    if 'numpy' in engines and importlib.util.find_spec('numpy') is None:
+        engines.remove('numpy')
+    grammars = [('10 layered rules', layered_grammar())]
+    for path in args.grammars.split(','):
+        with open(path) as f:
+            grammars.append((os.path.basename(path), f.read()))
+    for name, bnf in grammars:
+        timings = []
+        for engine in engines:
+            generator = pybnfuzzer.build_engine(pybnfuzzer.parse_bnf(bnf), pybnfuzzer.EngineOptions(engine=engine))
+            context = pybnfuzzer.GenerationContext.from_seed(0)
+            written = 0
+
+            def write(value: str) -> None:
+                nonlocal written
+                written += len(value)
+
+            start = time.perf_counter()
+            pybnfuzzer.write_many(generator, context, args.count, '\n', write)
+            elapsed = time.perf_counter() - start
+            timings.append(f'{engine} {elapsed:.2f} s ({written / elapsed / 1e6:.1f} MB/s)')
+        print(f'{name}, {args.count} strings: {', '.join(timings)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# measures lexing throughput on a large machine-generated grammar
+#
+# usage:
+#     python benchmarks/lexer.py [--rules <n>] [--repeat <n>]
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pybnfuzzer
+
+
+def synthetic_grammar(rules: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    lines = ['# synthetic grammar', '<start> ::= <rule-0> ;']
+    for idx in range(rules):
+        alternatives = []
+        for _ in range(rng.randint(1, 4)):
+            parts = []
+            for _ in range(rng.randint(1, 5)):
+                kind = rng.randrange(4)
+                if kind == 0:
+                    parts.append(f'<rule-{rng.randrange(rules)}>')
+                elif kind == 1:
+                    parts.append('"' + 'x' * rng.randint(1, 40) + '\\n"')
+                elif kind == 2:
+                    parts.append("/[a-z]{1,8}'/[0-9]+/")
+                else:
+                    parts.append(f'"{rng.choice(("if", "else", "+", "-"))}"{rng.choice(("", "?", "*", "+"))}')
+            alternatives.append(' '.join(parts))
+        lines.append(f'<rule-{idx}> ::= {' | '.join(alternatives)} ;  # rule {idx}')
+    return '\n'.join(lines) + '\n'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser('lexer', description='benchmark pybnfuzzer.lex_bnf')
+    parser.add_argument('--rules', type=int, default=50_000, metavar='<n>')
+    parser.add_argument('--repeat', type=int, default=5, metavar='<n>')
+    args = parser.parse_args()
+
+    bnf = synthetic_grammar(args.rules)
+    size = len(bnf.encode()) / 1e6
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        tokens = pybnfuzzer.lex_bnf(bnf)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    print(f'{args.rules} rules, {size:.1f} MB, {len(tokens)} tokens')
+    print(f'best of {args.repeat}: {best:.3f} s, {size / best:.1f} MB/s')
+
+
+if __name__ == '__main__':
+    main()
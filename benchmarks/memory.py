@@ -0,0 +1,50 @@
+# measures the memory taken by a parsed grammar with many rules
+#
+# usage:
+#     python benchmarks/memory.py [--rules <n>]
+
+import argparse
+import gc
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pybnfuzzer
+
+from lexer import synthetic_grammar
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser('memory', description='benchmark memory use of parsed grammars')
+    parser.add_argument('--rules', type=int, default=100_000, metavar='<n>')
+    args = parser.parse_args()
+
+    bnf = synthetic_grammar(args.rules)
+    gc.collect()
+
+    start = time.perf_counter()
+    pybnfuzzer.parse_bnf(bnf)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    entry_point = pybnfuzzer.parse_bnf(bnf)
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    nodes = sum(
+        sum(1 for _ in pybnfuzzer.iter_rule_nodes(rule)) for rule in entry_point.context.values()
+    )
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f'{args.rules} rules, {len(bnf.encode()) / 1e6:.1f} MB of BNF, {nodes} nodes')
+    print(f'parse time: {elapsed:.2f} s')
+    print(f'retained by the parsed grammar: {retained / 1e6:.1f} MB ({retained / nodes:.0f} B per node)')
+    print(f'peak while parsing: {peak / 1e6:.1f} MB, max RSS: {max_rss:.0f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,35 @@
-from typing import NoReturn
+from typing import NoReturn, Iterator, Iterable, Callable, Sequence, TextIO, ClassVar
 
 import sys
 import string
 import enum
 import dataclasses
 import random
+import math
+import fractions
 import re
+import types
+import functools
+import itertools
+import concurrent.futures
+import os
 import argparse
-
-from rstr.xeger import Xeger
+import hashlib
+import pickle
+import tempfile
+import array
+import multiprocessing.shared_memory
+
+# regexes are expanded from the parse trees of the re module, whose parser is
+# private and was last moved in Python 3.11; pybnfuzzer supports 3.12 and 3.13
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+    sre_constants.ATOMIC_GROUP, sre_constants.POSSESSIVE_REPEAT, sre_constants.CATEGORY_DIGIT
+except (ImportError, AttributeError) as error:
+    raise ImportError(
+        f'pybnfuzzer supports Python 3.12 and 3.13; the regex parser of Python '
+        f'{sys.version_info.major}.{sys.version_info.minor} is not compatible'
+    ) from error
 
 
 BNF_SYNTAX = """\
@@ -42,6 +63,12 @@ Choices between several variants are denoted by a vertical bar "|":
 
     <digits> ::= "0" | "1" | "2" | "3" | "4" | "5" | "6" | "7" | "8" | "9" ;
 
+Every variant is picked with the same probability, unless it is prefixed with
+a positive integer weight and a colon. Variants without a weight have a weight
+of 1:
+
+    <statement> ::= 8: <assignment> | 2: <call> | <loop> ;
+
 For convenience, regular expressions can be used to describe terminal rules.
 The expression must be enclosed between slash symbols "/":
 
@@ -54,9 +81,10 @@ Literal "/" within regular expressions must be escaped with a "'". A literal
     <five-slashes>            ::= /'/{5}/ ;
     <digits-in-single-quotes> ::= /''\\d+''/ ;
 
-Not all Python regexp features are supported; for more information, please
-refer to the rstr module documentation:
-https://github.com/leapfrogonline/rstr
+Regular expressions are expanded by pybnfuzzer itself. "*", "+" and repeats
+with large bounds are repeated at most 5 times, but never less than their
+lower bound. "." and negated character classes produce printable ASCII
+characters. Anchors and lookarounds are ignored.
 
 Some extra rule modifiers are also supported. The "?" denotes an optional rule
 that appers once or not at all:
@@ -71,31 +99,91 @@ The "*" denotes a rule that appears several times or not at all:
 
     <octothorps-or-an-empty-string> ::= "#"* ;
 
+Rules marked with "*" and "+" are repeated at most 5 times. The limits can be
+changed with the --star-limit and --plus-limit options.
+
+Explicit bounds on the number of repetitions are given in curly braces. "{n}"
+repeats a rule exactly n times, and "{m,n}" repeats it from m to n times:
+
+    <three-octothorps> ::= "#"{3} ;
+    <arguments>        ::= <argument> <next-argument>{0,100} ;
+
 This covers all of the supported BNF syntax."""
 
 ALLOWED_SYMBOL_NAME_CHARACTERS = string.ascii_letters + string.digits + '-_'
+BNF_CHUNK_SIZE = 1 << 20
 START_LIMIT         = 5
 PLUS_LIMIT          = 5
 REGEXP_REPEAT_LIMIT = 5
 
+# number of random words drawn at once by engines with batched random numbers
+RANDOM_BLOCK_SIZE = 4096
+# number of fragments the VM collects before it joins them and passes them on
+OUTPUT_BUFFER_SIZE = 4096
+# largest number that fits into the 64-bit arrays of the "flat" engine
+FLAT_INT_LIMIT = 2 ** 63 - 1
+
+EXPECTED_LENGTH_ROUNDS = 200
+EXPECTED_LENGTH_LIMIT  = 1e12
 
-# patch Xeger to generate less characters from * and +
-Xegerm = Xeger
+# finite sub-languages that fit in tables of at most this many strings are precomputed
+TABLE_SIZE_LIMIT = 1024
+# and the strings in them are at most this long
+TABLE_LENGTH_LIMIT = 4096
+# non-recursive rules with at most this many nodes are inlined into the rules using them
+INLINE_SIZE_LIMIT = 8
+# nested alternations are merged while the result has at most this many alternatives
+ALTERNATION_SIZE_LIMIT = 64
 
-def _handle_repeat(self: Xeger, start_range: int, end_range: int, value: str) -> str:
-    result = []
-    end_range = min((end_range, self.star_plus_limit))
-    times = self._random.randint(start_range, end_range)
-    for _ in range(times):
-        result.append(''.join(self._handle_state(i) for i in value))
-    return ''.join(result)
+# sub-languages with at most this many strings are kept in memory while enumerating
+ENUMERATION_MEMO_LIMIT = 4096
 
-Xegerm._handle_repeat = _handle_repeat
-xegerm = Xegerm()
+# how strongly choices steered toward a target length lean toward options that
+# fill their share of it; lower values follow the weights of the grammar more
+# closely, higher values hit the target more often
+LENGTH_TILT = 4
 
-def random_string_from_regex(regex: re.Pattern, star_plus_limit: int = REGEXP_REPEAT_LIMIT) -> str:
-    xegerm.star_plus_limit = star_plus_limit
-    return xegerm.xeger(regex)
+
+# random 32-bit words drawn from a generator in blocks, so that picking one
+# of n options is a multiplication and a shift instead of a call into it
+@dataclasses.dataclass
+class RandomWords:
+    rng: random.Random
+    words: list[int] = dataclasses.field(default_factory=list)
+    position: int = 0
+
+    def refill(self) -> list[int]:
+        block = array.array('I')
+        block.frombytes(self.rng.getrandbits(32 * RANDOM_BLOCK_SIZE).to_bytes(4 * RANDOM_BLOCK_SIZE, 'little'))
+        # the same seed gives the same words on every platform
+        if sys.byteorder == 'big':
+            block.byteswap()
+        self.words = block.tolist()
+        self.position = 0
+        return self.words
+
+
+# every generator has its own random state, so that concurrent generators
+# neither contend on nor corrupt a shared one
+@dataclasses.dataclass
+class GenerationContext:
+    random: random.Random
+    # shares the random state, and keeps unused words between generated strings
+    words: RandomWords = dataclasses.field(init=False)
+
+    def __post_init__(self) -> None:
+        self.words = RandomWords(self.random)
+
+    @classmethod
+    def from_seed(cls, seed: int | str | None = None) -> 'GenerationContext':
+        return cls(random.Random(seed))
+
+    # used by grammars compiled to python, which only get the context to work with
+    def regex_sampler(self, pattern: str) -> Callable[[], str]:
+        return functools.partial(compile_regex_sampler(re.compile(pattern)).sample, self.random)
+
+    def alias_sampler(self, weights: tuple[int, ...]) -> Callable[[], int]:
+        return functools.partial(AliasTable.from_weights(weights).sample, self.random)
 
 
 # primitive error handling (not handle anything and just die)
@@ -108,6 +196,217 @@ def report_error_and_exit(error_text: str, exit_code: int = 1) -> NoReturn:
     raise SystemExit(exit_code)
 
 
+# regex sampling
+REGEX_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT:     string.digits,
+    sre_constants.CATEGORY_NOT_DIGIT: string.ascii_letters + string.punctuation,
+    sre_constants.CATEGORY_SPACE:     string.whitespace,
+    sre_constants.CATEGORY_NOT_SPACE: string.printable.strip(),
+    sre_constants.CATEGORY_WORD:      string.ascii_letters + string.digits + '_',
+    sre_constants.CATEGORY_NOT_WORD:  ''.join(
+        c for c in string.printable if c not in string.ascii_letters + string.digits + '_'
+    ),
+}
+
+def regex_character_class(op: sre_constants._NamedIntConstant, av: object) -> str:
+    # the alphabets regexes draw characters from, the same ones rstr used
+    if op is sre_constants.LITERAL:
+        return chr(av)
+    elif op is sre_constants.NOT_LITERAL:
+        return string.printable.replace(chr(av), '')
+    elif op is sre_constants.ANY:
+        return string.printable.replace('\n', '')
+    negate = False
+    chars: list[str] = []
+    for item_op, item_av in av:
+        if item_op is sre_constants.NEGATE:
+            negate = True
+        elif item_op is sre_constants.LITERAL:
+            chars.append(chr(item_av))
+        elif item_op is sre_constants.RANGE:
+            chars.extend(chr(c) for c in range(item_av[0], item_av[1] + 1))
+        elif item_op is sre_constants.CATEGORY:
+            chars.extend(REGEX_CATEGORIES[item_av])
+    if negate:
+        return ''.join(c for c in string.printable if c not in chars)
+    return ''.join(dict.fromkeys(chars))
+
+
+class RegexOp(enum.Enum):
+    LITERAL      = enum.auto()
+    CHARS        = enum.auto()
+    REPEAT_CHARS = enum.auto()
+    REPEAT       = enum.auto()
+    BRANCH       = enum.auto()
+    GROUP        = enum.auto()
+    GROUPREF     = enum.auto()
+
+
+type RegexInstruction = tuple[RegexOp, object]
+
+# a regular expression parsed once into a tree of instructions: adjacent
+# literals are joined and character classes are expanded into the strings
+# of characters they draw from
+@dataclasses.dataclass(slots=True)
+class RegexSampler:
+    pattern: str
+    program: tuple[RegexInstruction, ...]
+
+    def sample(self, rng: random.Random) -> str:
+        program = self.program
+        if len(program) == 1 and program[0][0] is RegexOp.REPEAT_CHARS:
+            # the most common kind of regex in grammars, such as /[a-z]+/ or /\d{5}/
+            low, high, chars = program[0][1]
+            return ''.join(rng.choices(chars, k=rng.randint(low, high)))
+        out: list[str] = []
+        write_regex(program, rng, out.append, {})
+        return ''.join(out)
+
+    def __repr__(self) -> str:
+        return f'RegexSampler({self.pattern!r})'
+
+
+def write_regex(
+    program: tuple[RegexInstruction, ...],
+    rng: random.Random,
+    emit: Callable[[str], object],
+    groups: dict[int, str]
+) -> None:
+    for op, arg in program:
+        if op is RegexOp.LITERAL:
+            emit(arg)
+        elif op is RegexOp.CHARS:
+            emit(rng.choice(arg))
+        elif op is RegexOp.REPEAT_CHARS:
+            low, high, chars = arg
+            emit(''.join(rng.choices(chars, k=rng.randint(low, high))))
+        elif op is RegexOp.REPEAT:
+            low, high, body = arg
+            for _ in range(rng.randint(low, high)):
+                write_regex(body, rng, emit, groups)
+        elif op is RegexOp.BRANCH:
+            write_regex(rng.choice(arg), rng, emit, groups)
+        elif op is RegexOp.GROUP:
+            group, body = arg
+            out: list[str] = []
+            write_regex(body, rng, out.append, groups)
+            groups[group] = ''.join(out)
+            emit(groups[group])
+        elif op is RegexOp.GROUPREF:
+            emit(groups.get(arg, ''))
+
+
+@functools.cache
+def compile_regex_sampler(pattern: re.Pattern, repeat_limit: int = REGEXP_REPEAT_LIMIT) -> RegexSampler:
+    parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    # only groups that are referenced later need their values remembered
+    referenced: set[int] = set()
+
+    def find_references(items: sre_parse.SubPattern | list) -> None:
+        for op, av in items:
+            if op is sre_constants.GROUPREF:
+                referenced.add(av)
+            elif op is sre_constants.BRANCH:
+                for branch in av[1]:
+                    find_references(branch)
+            elif op is sre_constants.SUBPATTERN:
+                find_references(av[3])
+            elif op is sre_constants.ATOMIC_GROUP:
+                find_references(av)
+            elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT, sre_constants.POSSESSIVE_REPEAT):
+                find_references(av[2])
+
+    def compile_items(items: sre_parse.SubPattern | list) -> tuple[RegexInstruction, ...]:
+        program: list[RegexInstruction] = []
+
+        def add(op: RegexOp, arg: object) -> None:
+            if op is RegexOp.LITERAL and program and program[-1][0] is RegexOp.LITERAL:
+                program[-1] = (op, program[-1][1] + arg)
+            elif op is not RegexOp.LITERAL or arg:
+                program.append((op, arg))
+
+        for op, av in items:
+            if op in (sre_constants.LITERAL, sre_constants.NOT_LITERAL, sre_constants.ANY, sre_constants.IN):
+                chars = regex_character_class(op, av)
+                if not chars:
+                    report_error_and_exit(f'regular expression /{pattern.pattern}/ has an empty character class')
+                add(RegexOp.LITERAL if len(chars) == 1 else RegexOp.CHARS, chars)
+            elif op is sre_constants.BRANCH:
+                add(RegexOp.BRANCH, tuple(compile_items(branch) for branch in av[1]))
+            elif op is sre_constants.SUBPATTERN:
+                group, body = av[0], compile_items(av[3])
+                if group in referenced:
+                    add(RegexOp.GROUP, (group, body))
+                else:
+                    for instruction in body:
+                        add(*instruction)
+            elif op is sre_constants.ATOMIC_GROUP:
+                for instruction in compile_items(av):
+                    add(*instruction)
+            elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT, sre_constants.POSSESSIVE_REPEAT):
+                min_times, max_times, sub = av
+                # repeats are capped, but never below their minimum
+                max_times = max(min_times, min(max_times, repeat_limit))
+                body = compile_items(sub)
+                if not body or max_times == 0:
+                    continue
+                elif len(body) == 1 and body[0][0] is RegexOp.LITERAL and min_times == max_times:
+                    add(RegexOp.LITERAL, body[0][1] * min_times)
+                elif len(body) == 1 and (
+                    body[0][0] is RegexOp.CHARS or body[0][0] is RegexOp.LITERAL and len(body[0][1]) == 1
+                ):
+                    add(RegexOp.REPEAT_CHARS, (min_times, max_times, body[0][1]))
+                else:
+                    add(RegexOp.REPEAT, (min_times, max_times, body))
+            elif op is sre_constants.GROUPREF:
+                add(RegexOp.GROUPREF, av)
+            elif op is sre_constants.GROUPREF_EXISTS:
+                report_error_and_exit(
+                    f'conditional groups in regular expressions are not supported: /{pattern.pattern}/'
+                )
+            # anchors and lookarounds do not produce characters
+        return tuple(program)
+
+    find_references(parsed)
+    return RegexSampler(pattern.pattern, compile_items(parsed))
+
+
+# weighted choices
+# Vose's alias method: every option owns one of n equally likely slots, and
+# keeps it with a probability of thresholds[slot] / total or gives it to
+# aliases[slot] otherwise, so a pick is two random draws and two lookups
+# whatever the number of options; weights are integers, so the table is exact
+@dataclasses.dataclass(slots=True)
+class AliasTable:
+    thresholds: tuple[int, ...]
+    aliases: tuple[int, ...]
+    total: int
+
+    @classmethod
+    def from_weights(cls, weights: Sequence[int]) -> 'AliasTable':
+        size, total = len(weights), sum(weights)
+        # weights scaled so that every slot holds exactly `total`
+        scaled = [weight * size for weight in weights]
+        thresholds = [total] * size
+        aliases = list(range(size))
+        small = [slot for slot, weight in enumerate(scaled) if weight < total]
+        large = [slot for slot, weight in enumerate(scaled) if weight >= total]
+        while small and large:
+            slot = small.pop()
+            donor = large[-1]
+            thresholds[slot] = scaled[slot]
+            aliases[slot] = donor
+            scaled[donor] -= total - scaled[slot]
+            if scaled[donor] < total:
+                large.pop()
+                small.append(donor)
+        return cls(tuple(thresholds), tuple(aliases), total)
+
+    def sample(self, rng: random.Random) -> int:
+        slot = rng.randrange(len(self.thresholds))
+        return slot if rng.randrange(self.total) < self.thresholds[slot] else self.aliases[slot]
+
+
 # tokens
 class TokenKind(enum.Enum):
     DEFINE    = enum.auto()
@@ -121,160 +420,144 @@ class TokenKind(enum.Enum):
     STAR      = enum.auto()
     PLUS      = enum.auto()
     OPTION    = enum.auto()
+    WEIGHT    = enum.auto()
+    REPEAT    = enum.auto()
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class Token:
     kind: TokenKind
     value: str | None
 
 
-def lex_bnf(bnf: str) -> list[Token]:
-    idx = 0
-    tokens = []
-    while idx < len(bnf):
-        if bnf[idx] == '<':
-            symbol_name = ''
-            idx += 1
-            while idx < len(bnf) and bnf[idx] != '>':
-                if bnf[idx] not in ALLOWED_SYMBOL_NAME_CHARACTERS:
-                    report_error_and_exit(
-                        'only ASCII uppercase and lowercase letters, digits, and "-" and "_" '
-                        f'characters are allowed in symbol names; got: "{bnf[idx]}"'
-                    )
-                symbol_name += bnf[idx]
-                idx += 1
-            if idx == len(bnf):
-                report_error_and_exit(f'unterminated rule name near "{symbol_name}"')
-            tokens.append(Token(TokenKind.SYMBOL, symbol_name))
-            idx += 1
-
-        elif bnf[idx] == ':':
-            if idx + 3 <= len(bnf) and bnf[idx:idx + 3] == '::=':
-                tokens.append(Token(TokenKind.DEFINE, None))
-                idx += 3
-            else:
-                report_error_and_exit('broken rule definition')
-
-        elif bnf[idx] == '"':
-            value = ''
-            idx += 1
-            while idx < len(bnf) and bnf[idx] != '"':
-                if bnf[idx] == '\\':
-                    idx += 1
-                    if bnf[idx] == 'n':
-                        value += '\n'
-                        idx += 1
-                        continue
-                    elif bnf[idx] == 't':
-                        value += '\t'
-                        idx += 1
-                        continue
-                    elif bnf[idx] == '\\':
-                        value += '\\'
-                        idx += 1
-                        continue
-                    else:
-                        report_error_and_exit(f'unrecognized escape sequence: \\"{bnf[idx]}"')
-                value += bnf[idx]
-                idx += 1
-            if idx == len(bnf):
-                report_error_and_exit(f'unterminated literal value near "{value}"')
-            tokens.append(Token(TokenKind.LITERAL, value))
-            idx += 1
-
-        elif bnf[idx] == "'":
-            value = ''
-            idx += 1
-            while idx < len(bnf) and bnf[idx] != "'":
-                if bnf[idx] == '\\':
-                    idx += 1
-                    if bnf[idx] == 'n':
-                        value += '\n'
-                        idx += 1
-                        continue
-                    elif bnf[idx] == 't':
-                        value += '\t'
-                        idx += 1
-                        continue
-                    elif bnf[idx] == '\\':
-                        value += '\\'
-                        idx += 1
-                        continue
-                    else:
-                        report_error_and_exit(f'unrecognized escape sequence: \\"{bnf[idx]}"')
-                value += bnf[idx]
-                idx += 1
-            if idx == len(bnf):
-                report_error_and_exit(f'unterminated literal value near "{value}"')
-            tokens.append(Token(TokenKind.LITERAL, value))
-            idx += 1
-
-        elif bnf[idx] == '/':
-            regex = ''
-            idx += 1
-            while idx < len(bnf) and bnf[idx] != '/':
-                if bnf[idx] == "'":
-                    idx += 1
-                    if idx < len(bnf):
-                        if bnf[idx] == '/':
-                            regex += '/'
-                            idx += 1
-                            continue
-                        elif bnf[idx] == "'":
-                            regex += "'"
-                            idx += 1
-                            continue
-                        else:
-                            report_error_and_exit('unrecognized escape sequence in regex')
-                    else:
-                        report_error_and_exit('broken escape sequence in regex')
-                regex += bnf[idx]
-                idx += 1
-            if idx == len(bnf):
-                report_error_and_exit(f'unterminated literal value near "{symbol_name}"')
-            tokens.append(Token(TokenKind.REGEX, regex))
-            idx += 1
-
-        elif bnf[idx] == ';':
-            tokens.append(Token(TokenKind.SEMICOLON, None))
-            idx += 1
-
-        elif bnf[idx] == '|':
-            tokens.append(Token(TokenKind.ALTER, None))
-            idx += 1
-
-        elif bnf[idx] == '(':
-            tokens.append(Token(TokenKind.OPAREN, None))
-            idx += 1
-
-        elif bnf[idx] == ')':
-            tokens.append(Token(TokenKind.CPAREN, None))
-            idx += 1
-
-        elif bnf[idx] == '*':
-            tokens.append(Token(TokenKind.STAR, None))
-            idx += 1
-
-        elif bnf[idx] == '+':
-            tokens.append(Token(TokenKind.PLUS, None))
-            idx += 1
-
-        elif bnf[idx] == '?':
-            tokens.append(Token(TokenKind.OPTION, None))
-            idx += 1
-
-        elif bnf[idx] == '#':
-            while idx < len(bnf) and bnf[idx] != '\n':
-                idx += 1
-
-        elif bnf[idx] in string.whitespace:
-            idx += 1
+BNF_WHITESPACE = re.escape(string.whitespace)
+
+# every match is one token together with the whitespace and comments before it;
+# the token kind is the name of the group that matched
+BNF_TOKEN_PATTERN = re.compile(rf"""
+    (?:[{BNF_WHITESPACE}]+|\#[^\n]*)*
+    (?:
+        <(?P<SYMBOL>[{re.escape(ALLOWED_SYMBOL_NAME_CHARACTERS)}]*)>
+      | "(?P<DOUBLE_QUOTED>[^"\\]*(?:\\.[^"\\]*)*)"
+      | '(?P<SINGLE_QUOTED>[^'\\]*(?:\\.[^'\\]*)*)'
+      | /(?P<REGEX>[^/']*(?:'.[^/']*)*)/
+      | (?P<WEIGHT>[0-9]+)[{BNF_WHITESPACE}]*:(?!:=)
+      | (?P<DEFINE>::=)
+      | (?P<SEMICOLON>;)
+      | (?P<ALTER>\|)
+      | (?P<OPAREN>\()
+      | (?P<CPAREN>\))
+      | (?P<STAR>\*)
+      | (?P<PLUS>\+)
+      | (?P<OPTION>\?)
+      | \{{[{BNF_WHITESPACE}]*(?P<REPEAT>[0-9]+[{BNF_WHITESPACE}]*(?:,[{BNF_WHITESPACE}]*[0-9]+[{BNF_WHITESPACE}]*)?)\}}
+      | (?P<ERROR>.)
+    )?
+""", re.VERBOSE | re.DOTALL)
+
+# tokens without a value are shared
+VALUELESS_TOKENS = {
+    kind.name: Token(kind, None)
+    for kind in TokenKind
+    if kind not in (TokenKind.SYMBOL, TokenKind.LITERAL, TokenKind.REGEX, TokenKind.WEIGHT, TokenKind.REPEAT)
+}
+
+LITERAL_ESCAPES = {'n': '\n', 't': '\t', '\\': '\\'}
+REGEX_ESCAPES   = {'/': '/', "'": "'"}
+
+
+def unescape_literal(match: re.Match) -> str:
+    escaped = LITERAL_ESCAPES.get(match[1])
+    if escaped is None:
+        report_error_and_exit(f'unrecognized escape sequence: \\"{match[1]}"')
+    return escaped
+
+
+def unescape_regex(match: re.Match) -> str:
+    escaped = REGEX_ESCAPES.get(match[1])
+    if escaped is None:
+        report_error_and_exit('unrecognized escape sequence in regex')
+    return escaped
+
+
+def report_lexing_error(bnf: str, idx: int) -> NoReturn:
+    char = bnf[idx]
+    if char == '<':
+        end = idx + 1
+        while end < len(bnf) and bnf[end] != '>':
+            if bnf[end] not in ALLOWED_SYMBOL_NAME_CHARACTERS:
+                report_error_and_exit(
+                    'only ASCII uppercase and lowercase letters, digits, and "-" and "_" '
+                    f'characters are allowed in symbol names; got: "{bnf[end]}"'
+                )
+            end += 1
+        report_error_and_exit(f'unterminated rule name near "{bnf[idx + 1:end]}"')
+    elif char == ':':
+        report_error_and_exit('broken rule definition')
+    elif char in string.digits:
+        end = idx
+        while end < len(bnf) and bnf[end] in string.digits:
+            end += 1
+        report_error_and_exit(f'missing ":" after the weight {bnf[idx:end]}')
+    elif char == '{':
+        end = bnf.find('}', idx)
+        report_error_and_exit(f'malformed repetition bounds near "{bnf[idx:end + 1 if end >= 0 else None]}"')
+    elif char in '"\'':
+        report_error_and_exit(f'unterminated literal value near "{bnf[idx + 1:]}"')
+    elif char == '/':
+        report_error_and_exit(f'unterminated regular expression near "{bnf[idx + 1:]}"')
+    report_error_and_exit(f'unrecognized symbol: "{char}" (code: {ord(char)})')
+
+
+# a failed match on these characters may just mean that the token continues in the next chunk
+UNFINISHED_TOKEN_STARTS = '<"\'/:{' + string.digits
+
+def lex_bnf_chunks(chunks: Iterable[str]) -> Iterator[Token]:
+    valueless = VALUELESS_TOKENS.get
+    SYMBOL, LITERAL, REGEX = TokenKind.SYMBOL, TokenKind.LITERAL, TokenKind.REGEX
+    buffer = ''
+    for chunk in itertools.chain(chunks, (None,)):
+        last = chunk is None
+        if not last:
+            buffer += chunk
+        pos = 0
+        for match in BNF_TOKEN_PATTERN.finditer(buffer):
+            kind = match.lastgroup
+            if not last and (
+                match.end() == len(buffer)
+                or kind == 'ERROR' and match.group(kind) in UNFINISHED_TOKEN_STARTS
+            ):
+                # wait for the next chunk, the token may not be complete yet
+                break
+            pos = match.end()
+            token = valueless(kind)
+            if token is not None:
+                yield token
+            elif kind == 'SYMBOL':
+                # symbol names are repeated all over the grammar and end up in every reference
+                yield Token(SYMBOL, sys.intern(match.group(kind)))
+            elif kind == 'DOUBLE_QUOTED' or kind == 'SINGLE_QUOTED':
+                value = match.group(kind)
+                if '\\' in value:
+                    value = re.sub(r'\\(.)', unescape_literal, value, flags=re.DOTALL)
+                yield Token(LITERAL, value)
+            elif kind == 'REGEX':
+                value = match.group(kind)
+                if "'" in value:
+                    value = re.sub(r"'(.)", unescape_regex, value, flags=re.DOTALL)
+                yield Token(REGEX, value)
+            elif kind == 'WEIGHT':
+                yield Token(TokenKind.WEIGHT, match.group(kind))
+            elif kind == 'REPEAT':
+                yield Token(TokenKind.REPEAT, match.group(kind))
+            elif kind == 'ERROR':
+                report_lexing_error(buffer, match.start(kind))
+            # otherwise only whitespace and comments were left
+        buffer = buffer[pos:]
 
-        else:
-            report_error_and_exit(f'unrecognized symbol: "{bnf[idx]}" (code: {ord(bnf[idx])})')
 
-    return tokens
+def lex_bnf(bnf: str) -> list[Token]:
+    return list(lex_bnf_chunks((bnf,)))
 
 
 # rules
@@ -285,15 +568,17 @@ type Rule = LiteralRule     \
           | ReferenceRule   \
           | OptionalRule    \
           | NoneOrMoreRule  \
-          | OneOrMoreRule
+          | OneOrMoreRule   \
+          | RepeatRule      \
+          | TableRule
 
 type DictOfRules = dict[str, Rule]
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class LiteralRule:
     value: str
 
-    def gen(self) -> str:
+    def gen(self, context: GenerationContext) -> str:
         return self.value
 
     def __repr__(self) -> str:
@@ -303,12 +588,17 @@ class LiteralRule:
         return repr(self)
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class RegexRule:
     value: re.Pattern
+    # the pattern is parsed once, when the rule is created
+    sampler: RegexSampler = dataclasses.field(init=False, compare=False)
 
-    def gen(self) -> str:
-        return random_string_from_regex(self.value)
+    def __post_init__(self) -> None:
+        self.sampler = compile_regex_sampler(self.value)
+
+    def gen(self, context: GenerationContext) -> str:
+        return self.sampler.sample(context.random)
 
     def __repr__(self) -> str:
         return f'RegexRule({self.value})'
@@ -317,12 +607,12 @@ class RegexRule:
         return repr(self)
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class CompoundRule:
     values: list[Rule]
 
-    def gen(self) -> str:
-        return ''.join(r.gen() for r in self.values)
+    def gen(self, context: GenerationContext) -> str:
+        return ''.join(r.gen(context) for r in self.values)
 
     def __repr__(self) -> str:
         return f'CompoundRule({', '.join(repr(v) for v in self.values)})'
@@ -331,50 +621,72 @@ class CompoundRule:
         return repr(self)
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class AlterationRule:
     values: list[Rule]
-
-    def gen(self) -> str:
-        value = random.choice(self.values)
-        return value.gen()
+    # relative weights of the values, or None when they are all equally likely
+    weights: list[int] | None = None
+    # built from the weights by link_rules(), once the values are final
+    table: AliasTable | None = dataclasses.field(default=None, compare=False)
+
+    def gen(self, context: GenerationContext) -> str:
+        if self.table is None:
+            value = context.random.choice(self.values)
+        else:
+            value = self.values[self.table.sample(context.random)]
+        return value.gen(context)
 
     def __repr__(self) -> str:
-        return f'AlterationRule({', '.join(repr(v) for v in self.values)})'
+        if self.weights is None:
+            return f'AlterationRule({', '.join(repr(v) for v in self.values)})'
+        return f'AlterationRule({', '.join(f'{w}: {v!r}' for v, w in zip(self.values, self.weights))})'
 
     def __str__(self) -> str:
         return repr(self)
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class ReferenceRule:
     symbol: str
     context: DictOfRules
-    __had_repr_call: bool = False
+    rule: Rule | None = dataclasses.field(default=None, compare=False)
+    # symbols printed by the outermost repr() call so far, and whether they are still being printed
+    _repr_in_progress: ClassVar[dict[str, bool]] = {}
 
-    def gen(self) -> str:
-        value = self.context.get(self.symbol)
-        if value is None:
-            report_error_and_exit(f'reference to an undefined rule <{self.symbol}>')
-        return value.gen()
+    def gen(self, context: GenerationContext) -> str:
+        return self.rule.gen(context)
+
+    def bind(self, context: GenerationContext) -> Callable[[], str]:
+        return functools.partial(self.gen, context)
 
     def __repr__(self) -> str:
-        if self.__had_repr_call:
+        printed = self._repr_in_progress
+        if printed.get(self.symbol):
             return f'ReferenceRule(<{self.symbol}> with reference to self)'
-        self.__had_repr_call = True
-        value = self.context.get(self.symbol)
-        return f'ReferenceRule(<{self.symbol}> with {value})'
+        elif self.symbol in printed:
+            # every rule is printed in full only once
+            return f'ReferenceRule(<{self.symbol}>)'
+        outermost = not printed
+        printed[self.symbol] = True
+        try:
+            value = self.context.get(self.symbol)
+            return f'ReferenceRule(<{self.symbol}> with {value})'
+        finally:
+            printed[self.symbol] = False
+            if outermost:
+                printed.clear()
 
     def __str__(self) -> str:
         return repr(self)
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class OptionalRule:
     value: Rule
 
-    def gen(self) -> str:
-        return self.value.gen() if random.choice((True, False)) else ''
+    def gen(self, context: GenerationContext) -> str:
+        # the same draw as the other engines, so that they all produce the same strings
+        return self.value.gen(context) if context.random.getrandbits(1) else ''
 
     def __repr__(self) -> str:
         return f'OptionalRule({self.value})'
@@ -383,13 +695,14 @@ class OptionalRule:
         return repr(self)
 
 
-@dataclasses.dataclass
+# the upper bounds of "*" and "+" can be changed with limit_repetitions()
+@dataclasses.dataclass(slots=True)
 class NoneOrMoreRule:
     value: Rule
+    high: int = START_LIMIT
 
-    def gen(self) -> str:
-        times = random.randint(0, START_LIMIT)
-        return ''.join(self.value.gen() for _ in range(times))
+    def gen(self, context: GenerationContext) -> str:
+        return gen_repeated(self.value, context, context.random.randint(0, self.high))
 
     def __repr__(self) -> str:
         return f'NoneOrMoreRule({self.value})'
@@ -398,13 +711,13 @@ class NoneOrMoreRule:
         return repr(self)
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class OneOrMoreRule:
     value: Rule
+    high: int = PLUS_LIMIT
 
-    def gen(self) -> str:
-        times = random.randint(1, PLUS_LIMIT)
-        return ''.join(self.value.gen() for _ in range(times))
+    def gen(self, context: GenerationContext) -> str:
+        return gen_repeated(self.value, context, context.random.randint(1, self.high))
 
     def __repr__(self) -> str:
         return f'OneOrMoreRule({self.value})'
@@ -413,44 +726,112 @@ class OneOrMoreRule:
         return repr(self)
 
 
-type DictOfSymbolDefinitions = dict[str, list[Token]]
+# explicit repetition bounds, as in <rule>{m,n} or <rule>{n}
+@dataclasses.dataclass(slots=True)
+class RepeatRule:
+    value: Rule
+    low: int
+    high: int
+
+    def gen(self, context: GenerationContext) -> str:
+        return gen_repeated(self.value, context, context.random.randint(self.low, self.high))
+
+    def __repr__(self) -> str:
+        return f'RepeatRule({self.value}, {self.low}..{self.high})'
+
+    def __str__(self) -> str:
+        return repr(self)
+
+
+type RepetitionRule = NoneOrMoreRule | OneOrMoreRule | RepeatRule
+
+def repeat_bounds(rule: RepetitionRule) -> tuple[int, int]:
+    if isinstance(rule, NoneOrMoreRule):
+        return 0, rule.high
+    elif isinstance(rule, OneOrMoreRule):
+        return 1, rule.high
+    return rule.low, rule.high
+
+
+def gen_repeated(value: Rule, context: GenerationContext, times: int) -> str:
+    # the repetitions are generated in a loop rather than by recursion, and
+    # literals are repeated in one go
+    if isinstance(value, LiteralRule):
+        return value.value * times
+    return ''.join([value.gen(context) for _ in range(times)])
+
+
+# a finite sub-language where every string is repeated in proportion to
+# its probability, so that picking one at random preserves the distribution
+@dataclasses.dataclass(slots=True)
+class TableRule:
+    values: tuple[str, ...]
+
+    def gen(self, context: GenerationContext) -> str:
+        return context.random.choice(self.values)
+
+    def __repr__(self) -> str:
+        return f'TableRule({', '.join(f'"{v.replace('\n', '\\n')}"' for v in self.values)})'
+
+    def __str__(self) -> str:
+        return repr(self)
+
 
-def parse_all_symbol_definitions(tokens: list[Token]) -> DictOfSymbolDefinitions:
-    idx = 0
-    definitions: DictOfSymbolDefinitions = {}
-    while idx < len(tokens):
-        if tokens[idx].kind == TokenKind.DEFINE:
-            if idx == 0 or tokens[idx - 1].kind != TokenKind.SYMBOL:
+def iter_symbol_definitions(tokens: Iterable[Token]) -> Iterator[tuple[str, list[Token]]]:
+    # definitions are passed on one at a time, as soon as their semicolon is read
+    tokens = iter(tokens)
+    defined: set[str] = set()
+    previous: Token | None = None
+    for token in tokens:
+        if token.kind == TokenKind.DEFINE:
+            if previous is None or previous.kind != TokenKind.SYMBOL:
                 report_error_and_exit('missing symbol for definition')
-            rule_symbol = tokens[idx - 1].value
+            rule_symbol = previous.value
             rule_tokens: list[Token] = []
-            idx += 1
-            while idx < len(tokens) and tokens[idx].kind != TokenKind.SEMICOLON:
-                rule_tokens.append(tokens[idx])
-                idx += 1
-            if idx >= len(tokens) or tokens[idx].kind != TokenKind.SEMICOLON:
+            for token in tokens:
+                if token.kind == TokenKind.SEMICOLON:
+                    break
+                rule_tokens.append(token)
+            else:
                 report_error_and_exit('missing semicolon for rule definition')
-            if rule_symbol in definitions:
+            if rule_symbol in defined:
                 report_error_and_exit(f'attempt to redefine existing rule "{rule_symbol}"')
-            definitions[rule_symbol] = rule_tokens
-        idx += 1
-    return definitions
+            defined.add(rule_symbol)
+            yield rule_symbol, rule_tokens
+        previous = token
 
 
-def parse_bnf_tokens(tokens: list[Token]) -> Rule:
-    definitions = parse_all_symbol_definitions(tokens)
-    if 'start' not in definitions:
-        report_error_and_exit('could not find an entry point; grammar must contain a <start> rule')
-
+def parse_bnf_tokens(tokens: Iterable[Token]) -> ReferenceRule:
     parsed_rules: DictOfRules = {}
+    # literals are never modified, so every occurrence of the same literal is shared
+    literal_rules: dict[str, LiteralRule] = {}
 
-    for rule_symbol, rule_tokens in definitions.items():
+    for rule_symbol, rule_tokens in iter_symbol_definitions(tokens):
         alteration_variants: list[LiteralRule | RegexRule | ReferenceRule | CompoundRule] = []
         current_variant_rules: list[LiteralRule | RegexRule | ReferenceRule] = []
+        # weights of the variants, including the current one; unweighted variants have a weight of 1
+        variant_weights: list[int] = [1]
+        weighted = False
         idx = 0
         while idx < len(rule_tokens):
-            if rule_tokens[idx].kind == TokenKind.LITERAL:
-                current_variant_rules.append(LiteralRule(rule_tokens[idx].value))
+            if rule_tokens[idx].kind == TokenKind.WEIGHT:
+                if current_variant_rules:
+                    report_error_and_exit(f'weight in the middle of a variant of rule <{rule_symbol}>')
+                elif idx and rule_tokens[idx - 1].kind == TokenKind.WEIGHT:
+                    report_error_and_exit(f'more than one weight for a variant of rule <{rule_symbol}>')
+                weight = int(rule_tokens[idx].value)
+                if weight == 0:
+                    report_error_and_exit(f'weights must be positive; got 0 in rule <{rule_symbol}>')
+                variant_weights[-1] = weight
+                weighted = True
+                idx += 1
+
+            elif rule_tokens[idx].kind == TokenKind.LITERAL:
+                value = rule_tokens[idx].value
+                literal = literal_rules.get(value)
+                if literal is None:
+                    literal = literal_rules[value] = LiteralRule(value)
+                current_variant_rules.append(literal)
                 idx += 1
 
             elif rule_tokens[idx].kind == TokenKind.REGEX:
@@ -462,20 +843,39 @@ def parse_bnf_tokens(tokens: list[Token]) -> Rule:
                 idx += 1
 
             elif rule_tokens[idx].kind == TokenKind.OPTION:
+                if not current_variant_rules:
+                    report_error_and_exit(f'nothing to make optional in rule <{rule_symbol}>')
                 to_make_optional = current_variant_rules.pop()
                 current_variant_rules.append(OptionalRule(to_make_optional))
                 idx += 1
 
             elif rule_tokens[idx].kind == TokenKind.STAR:
+                if not current_variant_rules:
+                    report_error_and_exit(f'nothing to repeat in rule <{rule_symbol}>')
                 to_make_repeatable = current_variant_rules.pop()
                 current_variant_rules.append(NoneOrMoreRule(to_make_repeatable))
                 idx += 1
 
             elif rule_tokens[idx].kind == TokenKind.PLUS:
+                if not current_variant_rules:
+                    report_error_and_exit(f'nothing to repeat in rule <{rule_symbol}>')
                 to_make_repeatable = current_variant_rules.pop()
                 current_variant_rules.append(OneOrMoreRule(to_make_repeatable))
                 idx += 1
 
+            elif rule_tokens[idx].kind == TokenKind.REPEAT:
+                if not current_variant_rules:
+                    report_error_and_exit(f'nothing to repeat in rule <{rule_symbol}>')
+                bounds = [int(bound) for bound in rule_tokens[idx].value.split(',')]
+                low, high = bounds[0], bounds[-1]
+                if low > high:
+                    report_error_and_exit(
+                        f'repetition bounds {{{low},{high}}} in rule <{rule_symbol}> are in the wrong order'
+                    )
+                to_make_repeatable = current_variant_rules.pop()
+                current_variant_rules.append(RepeatRule(to_make_repeatable, low, high))
+                idx += 1
+
             elif rule_tokens[idx].kind == TokenKind.ALTER:
                 if len(current_variant_rules) == 0:
                     report_error_and_exit(f'empty alteration variant in rule <{rule_symbol}>')
@@ -485,6 +885,7 @@ def parse_bnf_tokens(tokens: list[Token]) -> Rule:
                     variant = CompoundRule(current_variant_rules)
                 alteration_variants.append(variant)
                 current_variant_rules = []
+                variant_weights.append(1)
                 idx += 1
 
             else:
@@ -506,15 +907,2908 @@ def parse_bnf_tokens(tokens: list[Token]) -> Rule:
         elif len(alteration_variants) == 1:
             rule = alteration_variants[0]
         else:
-            rule = AlterationRule(alteration_variants)
+            rule = AlterationRule(alteration_variants, variant_weights if weighted else None)
         parsed_rules[rule_symbol] = rule
 
+    if 'start' not in parsed_rules:
+        report_error_and_exit('could not find an entry point; grammar must contain a <start> rule')
     return ReferenceRule('start', parsed_rules)
 
 
+def iter_rule_nodes(rule: Rule) -> Iterator[Rule]:
+    # does not follow references, so every node of a rule body is visited once
+    stack = [rule]
+    while stack:
+        node = stack.pop()
+        yield node
+        if isinstance(node, CompoundRule | AlterationRule):
+            stack.extend(reversed(node.values))
+        elif isinstance(node, OptionalRule | NoneOrMoreRule | OneOrMoreRule | RepeatRule):
+            stack.append(node.value)
+
+
+def link_rules(entry_point: ReferenceRule) -> ReferenceRule:
+    rules = entry_point.context
+    for rule in (entry_point, *rules.values()):
+        for node in iter_rule_nodes(rule):
+            if isinstance(node, AlterationRule):
+                node.table = None if node.weights is None else AliasTable.from_weights(node.weights)
+            if not isinstance(node, ReferenceRule):
+                continue
+            target = rules.get(node.symbol)
+            if target is None:
+                report_error_and_exit(f'reference to an undefined rule <{node.symbol}>')
+            node.rule = target
+    return entry_point
+
+
+def limit_repetitions(entry_point: ReferenceRule, star_limit: int, plus_limit: int) -> ReferenceRule:
+    # sets how many times rules marked with "*" and "+" can be repeated at most
+    if star_limit < 0:
+        report_error_and_exit(f'the limit of "*" repetitions cannot be negative; got {star_limit}')
+    elif plus_limit < 1:
+        report_error_and_exit(f'the limit of "+" repetitions must be at least 1; got {plus_limit}')
+    for rule in entry_point.context.values():
+        for node in iter_rule_nodes(rule):
+            if isinstance(node, NoneOrMoreRule):
+                node.high = star_limit
+            elif isinstance(node, OneOrMoreRule):
+                node.high = plus_limit
+    return entry_point
+
+
+# analysis
+def rule_min_depth(rule: Rule, depths: dict[str, float]) -> float:
+    if isinstance(rule, LiteralRule | RegexRule | TableRule | OptionalRule | NoneOrMoreRule):
+        return 0
+    elif isinstance(rule, RepeatRule) and rule.low == 0:
+        return 0
+    elif isinstance(rule, ReferenceRule):
+        return 1 + depths[rule.symbol]
+    elif isinstance(rule, CompoundRule):
+        return max(rule_min_depth(v, depths) for v in rule.values)
+    elif isinstance(rule, AlterationRule):
+        return min(rule_min_depth(v, depths) for v in rule.values)
+    elif isinstance(rule, OneOrMoreRule | RepeatRule):
+        return rule_min_depth(rule.value, depths)
+    report_error_and_exit(f'cannot analyze rule {rule}')
+
+
+def compute_min_depths(rules: DictOfRules) -> dict[str, float]:
+    # minimum number of nested rule references needed to finish expanding each
+    # rule; rules that can never finish are left with an infinite depth
+    depths = dict.fromkeys(rules, math.inf)
+    changed = True
+    while changed:
+        changed = False
+        for rule_symbol, rule in rules.items():
+            depth = rule_min_depth(rule, depths)
+            if depth < depths[rule_symbol]:
+                depths[rule_symbol] = depth
+                changed = True
+    return depths
+
+
+@functools.cache
+def regex_length_bounds(pattern: re.Pattern, repeat_limit: int = REGEXP_REPEAT_LIMIT) -> tuple[int, int]:
+    # mirrors compile_regex_sampler: repeats are capped, but never below their minimum
+    def bounds(items: sre_parse.SubPattern | list) -> tuple[int, int]:
+        low = high = 0
+        for op, av in items:
+            if op in (sre_constants.LITERAL, sre_constants.NOT_LITERAL, sre_constants.ANY, sre_constants.IN):
+                low += 1
+                high += 1
+            elif op is sre_constants.BRANCH:
+                branches = [bounds(branch) for branch in av[1]]
+                low += min(b[0] for b in branches)
+                high += max(b[1] for b in branches)
+            elif op is sre_constants.SUBPATTERN:
+                sub_low, sub_high = bounds(av[3])
+                low += sub_low
+                high += sub_high
+            elif op is sre_constants.ATOMIC_GROUP:
+                sub_low, sub_high = bounds(av)
+                low += sub_low
+                high += sub_high
+            elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT, sre_constants.POSSESSIVE_REPEAT):
+                min_times, max_times, sub = av
+                sub_low, sub_high = bounds(sub)
+                low += min_times * sub_low
+                high += max(min_times, min(max_times, repeat_limit)) * sub_high
+            # anchors, lookarounds and group references are not counted
+        return low, high
+    return bounds(sre_parse.parse(pattern.pattern, pattern.flags))
+
+
+# with `expected_regexes`, regexes count with their expected length instead:
+# the vm cannot steer them, so that is the least they should be budgeted for
+def rule_min_length(rule: Rule, lengths: dict[str, float], expected_regexes: bool = False) -> float:
+    if isinstance(rule, LiteralRule):
+        return len(rule.value)
+    elif isinstance(rule, RegexRule):
+        low, high = regex_length_bounds(rule.value)
+        return (low + high) / 2 if expected_regexes else low
+    elif isinstance(rule, TableRule):
+        return min(len(v) for v in rule.values)
+    elif isinstance(rule, ReferenceRule):
+        return lengths[rule.symbol]
+    elif isinstance(rule, CompoundRule):
+        return sum(rule_min_length(v, lengths, expected_regexes) for v in rule.values)
+    elif isinstance(rule, AlterationRule):
+        return min(rule_min_length(v, lengths, expected_regexes) for v in rule.values)
+    elif isinstance(rule, OptionalRule):
+        return 0
+    elif isinstance(rule, NoneOrMoreRule | OneOrMoreRule | RepeatRule):
+        # no repetitions at all take no length, even if the value can never finish
+        low, _ = repeat_bounds(rule)
+        return low * rule_min_length(rule.value, lengths, expected_regexes) if low else 0
+    report_error_and_exit(f'cannot analyze rule {rule}')
+
+
+def compute_min_lengths(rules: DictOfRules, expected_regexes: bool = False) -> dict[str, float]:
+    lengths = dict.fromkeys(rules, math.inf)
+    changed = True
+    while changed:
+        changed = False
+        for rule_symbol, rule in rules.items():
+            length = rule_min_length(rule, lengths, expected_regexes)
+            if length < lengths[rule_symbol]:
+                lengths[rule_symbol] = length
+                changed = True
+    return lengths
+
+
+def rule_expected_length(rule: Rule, lengths: dict[str, float]) -> float:
+    if isinstance(rule, LiteralRule):
+        return len(rule.value)
+    elif isinstance(rule, RegexRule):
+        return sum(regex_length_bounds(rule.value)) / 2
+    elif isinstance(rule, TableRule):
+        return sum(len(v) for v in rule.values) / len(rule.values)
+    elif isinstance(rule, ReferenceRule):
+        return lengths[rule.symbol]
+    elif isinstance(rule, CompoundRule):
+        return sum(rule_expected_length(v, lengths) for v in rule.values)
+    elif isinstance(rule, AlterationRule):
+        if rule.weights is None:
+            return sum(rule_expected_length(v, lengths) for v in rule.values) / len(rule.values)
+        return sum(
+            w * rule_expected_length(v, lengths) for v, w in zip(rule.values, rule.weights)
+        ) / sum(rule.weights)
+    elif isinstance(rule, OptionalRule):
+        return rule_expected_length(rule.value, lengths) / 2
+    elif isinstance(rule, NoneOrMoreRule | OneOrMoreRule | RepeatRule):
+        times = sum(repeat_bounds(rule)) / 2
+        return times * rule_expected_length(rule.value, lengths) if times else 0
+    report_error_and_exit(f'cannot analyze rule {rule}')
+
+
+def compute_expected_lengths(rules: DictOfRules) -> dict[str, float]:
+    # expected lengths under weighted choices; rules whose expansion keeps
+    # growing on average are given an infinite expected length
+    lengths = dict.fromkeys(rules, 0.0)
+    for _ in range(EXPECTED_LENGTH_ROUNDS):
+        changed = False
+        for rule_symbol, rule in rules.items():
+            length = rule_expected_length(rule, lengths)
+            if length > EXPECTED_LENGTH_LIMIT:
+                length = math.inf
+            if not math.isclose(length, lengths[rule_symbol], rel_tol=1e-9):
+                lengths[rule_symbol] = length
+                changed = True
+        if not changed:
+            break
+    return lengths
+
+
+# `expected_regexes` works as in rule_min_length()
+def rule_max_length(rule: Rule, lengths: dict[str, float], expected_regexes: bool = False) -> float:
+    if isinstance(rule, LiteralRule):
+        return len(rule.value)
+    elif isinstance(rule, RegexRule):
+        low, high = regex_length_bounds(rule.value)
+        return (low + high) / 2 if expected_regexes else high
+    elif isinstance(rule, TableRule):
+        return max(len(v) for v in rule.values)
+    elif isinstance(rule, ReferenceRule):
+        return lengths[rule.symbol]
+    elif isinstance(rule, CompoundRule):
+        return sum(rule_max_length(v, lengths, expected_regexes) for v in rule.values)
+    elif isinstance(rule, AlterationRule):
+        return max(rule_max_length(v, lengths, expected_regexes) for v in rule.values)
+    elif isinstance(rule, OptionalRule):
+        return rule_max_length(rule.value, lengths, expected_regexes)
+    elif isinstance(rule, NoneOrMoreRule | OneOrMoreRule | RepeatRule):
+        _, high = repeat_bounds(rule)
+        return high * rule_max_length(rule.value, lengths, expected_regexes) if high else 0
+    report_error_and_exit(f'cannot analyze rule {rule}')
+
+
+def compute_max_lengths(rules: DictOfRules, expected_regexes: bool = False) -> dict[str, float]:
+    # lengths only settle within as many rounds as there are rules, unless a
+    # rule can grow without bound; those are given an infinite maximum length,
+    # which reaches every rule that depends on them in as many rounds again
+    lengths = dict.fromkeys(rules, 0.0)
+    for rounds in range(2 * len(rules) + 2):
+        changed = False
+        for rule_symbol, rule in rules.items():
+            length = rule_max_length(rule, lengths, expected_regexes)
+            if length > lengths[rule_symbol]:
+                lengths[rule_symbol] = length if rounds <= len(rules) else math.inf
+                changed = True
+        if not changed:
+            break
+    return lengths
+
+
+def parse_bnf_chunks(chunks: Iterable[str]) -> ReferenceRule:
+    # chunks are lexed and parsed as they come, so the whole grammar text
+    # never has to be in memory at once
+    return link_rules(parse_bnf_tokens(lex_bnf_chunks(chunks)))
+
+
 def parse_bnf(bnf: str) -> ReferenceRule:
-    tokens = lex_bnf(bnf)
-    return parse_bnf_tokens(tokens)
+    return parse_bnf_chunks((bnf,))
+
+
+def read_chunks(f: TextIO, chunk_size: int = BNF_CHUNK_SIZE) -> Iterator[str]:
+    return iter(functools.partial(f.read, chunk_size), '')
+
+
+# tables
+type Language = dict[str, fractions.Fraction]
+
+def concatenate_languages(first: Language, second: Language) -> Language | None:
+    if len(first) * len(second) > TABLE_SIZE_LIMIT:
+        return None
+    language: Language = {}
+    for head, head_probability in first.items():
+        for tail, tail_probability in second.items():
+            value = head + tail
+            language[value] = language.get(value, 0) + head_probability * tail_probability
+    return language
+
+
+def mix_languages(languages: list[Language], weights: list[int] | None = None) -> Language | None:
+    # every language is picked with the same probability, unless it is weighted
+    if weights is None:
+        weights = [1] * len(languages)
+    total = sum(weights)
+    mixed: Language = {}
+    for language, weight in zip(languages, weights):
+        for value, probability in language.items():
+            mixed[value] = mixed.get(value, 0) + probability * fractions.Fraction(weight, total)
+    return mixed if len(mixed) <= TABLE_SIZE_LIMIT else None
+
+
+def repeat_language(language: Language, low: int, high: int) -> Language | None:
+    longest = max(len(value) for value in language)
+    if not longest:
+        return language
+    # every number of repetitions of a non-empty string gives a different string
+    if high - low >= TABLE_SIZE_LIMIT or high * longest > TABLE_LENGTH_LIMIT:
+        return None
+    if len(language) == 1:
+        # a single string is repeated at once rather than concatenated over and over
+        value, = language
+        return mix_languages([{value * times: fractions.Fraction(1)} for times in range(low, high + 1)])
+    repeated: Language | None = {'': fractions.Fraction(1)}
+    repeats: list[Language] = []
+    for times in range(high + 1):
+        if times >= low:
+            repeats.append(repeated)
+        if times < high:
+            repeated = concatenate_languages(repeated, language)
+            if repeated is None:
+                return None
+    return mix_languages(repeats)
+
+
+def rule_language(rule: Rule, languages: dict[str, Language | None]) -> Language | None:
+    # strings a rule can produce with their probabilities, if there are few enough of them
+    if isinstance(rule, LiteralRule):
+        return {rule.value: fractions.Fraction(1)}
+    elif isinstance(rule, TableRule):
+        return mix_languages([{v: fractions.Fraction(1)} for v in rule.values])
+    elif isinstance(rule, RegexRule):
+        return None
+    elif isinstance(rule, ReferenceRule):
+        return languages[rule.symbol]
+    elif isinstance(rule, CompoundRule):
+        language: Language | None = {'': fractions.Fraction(1)}
+        for value in rule.values:
+            value_language = rule_language(value, languages)
+            if value_language is None:
+                return None
+            language = concatenate_languages(language, value_language)
+            if language is None:
+                return None
+        return language
+    elif isinstance(rule, AlterationRule):
+        alternatives = [rule_language(v, languages) for v in rule.values]
+        if any(a is None for a in alternatives):
+            return None
+        return mix_languages(alternatives, rule.weights)
+    value_language = rule_language(rule.value, languages)
+    if value_language is None:
+        return None
+    elif isinstance(rule, OptionalRule):
+        return repeat_language(value_language, 0, 1)
+    elif isinstance(rule, NoneOrMoreRule | OneOrMoreRule | RepeatRule):
+        return repeat_language(value_language, *repeat_bounds(rule))
+    report_error_and_exit(f'cannot analyze rule {rule}')
+
+
+def compute_languages(rules: DictOfRules) -> dict[str, Language | None]:
+    # recursive rules and rules that depend on them are never finite,
+    # so they are left without a language
+    languages: dict[str, Language | None] = dict.fromkeys(rules)
+    changed = True
+    while changed:
+        changed = False
+        for rule_symbol, rule in rules.items():
+            if languages[rule_symbol] is not None:
+                continue
+            language = rule_language(rule, languages)
+            if language is not None:
+                languages[rule_symbol] = language
+                changed = True
+    return languages
+
+
+def language_table(language: Language) -> tuple[str, ...] | None:
+    size = math.lcm(*(p.denominator for p in language.values()))
+    if size > TABLE_SIZE_LIMIT:
+        return None
+    return tuple(v for v, p in language.items() for _ in range(int(p * size)))
+
+
+def tabulate_rule(rule: Rule, languages: dict[str, Language | None]) -> Rule:
+    if isinstance(rule, LiteralRule | RegexRule | ReferenceRule | TableRule):
+        return rule
+    language = rule_language(rule, languages)
+    table = None if language is None else language_table(language)
+    if table is not None:
+        return LiteralRule(table[0]) if len(language) == 1 else TableRule(table)
+    elif isinstance(rule, CompoundRule | AlterationRule):
+        rule.values = [tabulate_rule(v, languages) for v in rule.values]
+    else:
+        rule.value = tabulate_rule(rule.value, languages)
+    return rule
+
+
+def tabulate_rules(rules: DictOfRules) -> None:
+    # replaces finite parts of the grammar with tables of every string they can produce
+    languages = compute_languages(rules)
+    for rule_symbol, rule in rules.items():
+        rules[rule_symbol] = tabulate_rule(rule, languages)
+
+
+# optimization
+def rule_references(rule: Rule) -> list[str]:
+    return [node.symbol for node in iter_rule_nodes(rule) if isinstance(node, ReferenceRule)]
+
+
+def strongly_connected_rules(rules: DictOfRules) -> list[list[str]]:
+    # Tarjan's algorithm; every component comes after all the components it references
+    index: dict[str, int] = {}
+    low: dict[str, int] = {}
+    stack: list[str] = []
+    on_stack: set[str] = set()
+    components: list[list[str]] = []
+    for root in rules:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(rule_references(rules[root])))]
+        while work:
+            symbol, references = work[-1]
+            reference = next(references, None)
+            if reference is None:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[symbol])
+                if low[symbol] == index[symbol]:
+                    component: list[str] = []
+                    while not component or component[-1] != symbol:
+                        component.append(stack.pop())
+                        on_stack.discard(component[-1])
+                    components.append(component)
+            elif reference not in rules:
+                # reported by link_rules
+                continue
+            elif reference not in index:
+                index[reference] = low[reference] = len(index)
+                stack.append(reference)
+                on_stack.add(reference)
+                work.append((reference, iter(rule_references(rules[reference]))))
+            elif reference in on_stack:
+                low[symbol] = min(low[symbol], index[reference])
+    return components
+
+
+def copy_rule(rule: Rule) -> Rule:
+    if isinstance(rule, CompoundRule):
+        return CompoundRule([copy_rule(v) for v in rule.values])
+    elif isinstance(rule, AlterationRule):
+        weights = None if rule.weights is None else list(rule.weights)
+        return AlterationRule([copy_rule(v) for v in rule.values], weights)
+    elif isinstance(rule, OptionalRule):
+        return OptionalRule(copy_rule(rule.value))
+    elif isinstance(rule, NoneOrMoreRule | OneOrMoreRule):
+        return type(rule)(copy_rule(rule.value), rule.high)
+    elif isinstance(rule, RepeatRule):
+        return RepeatRule(copy_rule(rule.value), rule.low, rule.high)
+    elif isinstance(rule, ReferenceRule):
+        return ReferenceRule(rule.symbol, rule.context)
+    return rule
+
+
+def inline_references(rule: Rule, inlined: DictOfRules) -> Rule:
+    if isinstance(rule, ReferenceRule):
+        body = inlined.get(rule.symbol)
+        return rule if body is None else copy_rule(body)
+    elif isinstance(rule, CompoundRule | AlterationRule):
+        rule.values = [inline_references(v, inlined) for v in rule.values]
+    elif isinstance(rule, OptionalRule | NoneOrMoreRule | OneOrMoreRule | RepeatRule):
+        rule.value = inline_references(rule.value, inlined)
+    return rule
+
+
+def inline_rules(rules: DictOfRules) -> None:
+    # rules are visited after every rule they reference, so the bodies
+    # being inlined have already had their own references inlined
+    inlined: DictOfRules = {}
+    for component in strongly_connected_rules(rules):
+        for rule_symbol in component:
+            rules[rule_symbol] = inline_references(rules[rule_symbol], inlined)
+        if len(component) > 1:
+            continue
+        rule_symbol, = component
+        rule = rules[rule_symbol]
+        if rule_symbol in rule_references(rule):
+            continue
+        if sum(1 for _ in iter_rule_nodes(rule)) <= INLINE_SIZE_LIMIT:
+            inlined[rule_symbol] = rule
+
+
+def fold_rule(rule: Rule) -> Rule:
+    # merges nested sequences and joins adjacent literals
+    if isinstance(rule, CompoundRule):
+        values: list[Rule] = []
+        for value in rule.values:
+            value = fold_rule(value)
+            for part in value.values if isinstance(value, CompoundRule) else [value]:
+                if isinstance(part, LiteralRule) and values and isinstance(values[-1], LiteralRule):
+                    values[-1] = LiteralRule(values[-1].value + part.value)
+                elif not isinstance(part, LiteralRule) or part.value:
+                    values.append(part)
+        if not values:
+            return LiteralRule('')
+        return values[0] if len(values) == 1 else CompoundRule(values)
+    elif isinstance(rule, AlterationRule):
+        rule.values = [fold_rule(v) for v in rule.values]
+    elif isinstance(rule, OptionalRule | NoneOrMoreRule | OneOrMoreRule | RepeatRule):
+        rule.value = fold_rule(rule.value)
+    return rule
+
+
+def flatten_alternations(rule: Rule) -> Rule:
+    if isinstance(rule, CompoundRule):
+        rule.values = [flatten_alternations(v) for v in rule.values]
+    elif isinstance(rule, OptionalRule | NoneOrMoreRule | OneOrMoreRule | RepeatRule):
+        rule.value = flatten_alternations(rule.value)
+    elif isinstance(rule, AlterationRule):
+        values = [flatten_alternations(v) for v in rule.values]
+        nested = [v for v in values if isinstance(v, AlterationRule)]
+        if not nested:
+            rule.values = values
+        elif rule.weights is None and all(v.weights is None for v in nested):
+            # every alternative is repeated so that it keeps its probability
+            size = math.lcm(*(len(v.values) for v in nested))
+            if size * len(values) <= ALTERNATION_SIZE_LIMIT:
+                flat: list[Rule] = []
+                for value in values:
+                    if isinstance(value, AlterationRule):
+                        flat.extend(value.values * (size // len(value.values)))
+                    else:
+                        flat.extend([value] * size)
+                values = flat
+            rule.values = values
+        else:
+            rule.values, rule.weights = merge_weighted_alternations(values, rule.weights)
+    return rule
+
+
+def merge_weighted_alternations(
+    values: list[Rule],
+    weights: list[int] | None
+) -> tuple[list[Rule], list[int] | None]:
+    # every alternative is weighted so that it keeps its probability
+    nested = [v.weights or [1] * len(v.values) for v in values if isinstance(v, AlterationRule)]
+    if len(values) - len(nested) + sum(map(len, nested)) > ALTERNATION_SIZE_LIMIT:
+        return values, weights
+    size = math.lcm(*map(sum, nested))
+    flat_values: list[Rule] = []
+    flat_weights: list[int] = []
+    for value, weight in zip(values, weights or itertools.repeat(1)):
+        if isinstance(value, AlterationRule):
+            nested_weights = value.weights or [1] * len(value.values)
+            scale = weight * size // sum(nested_weights)
+            flat_values.extend(value.values)
+            flat_weights.extend(w * scale for w in nested_weights)
+        else:
+            flat_values.append(value)
+            flat_weights.append(weight * size)
+    divisor = math.gcd(*flat_weights)
+    return flat_values, [w // divisor for w in flat_weights]
+
+
+# flattened alternations repeat the same alternative objects to keep their
+# probabilities, and there can be thousands of repeats; whatever an engine builds
+# for an alternative is built once per object and shared by all its repeats
+def build_once[T](built: dict[int, T], rule: Rule, build: Callable[[Rule], T]) -> T:
+    if id(rule) not in built:
+        built[id(rule)] = build(rule)
+    return built[id(rule)]
+
+
+def drop_unreachable_rules(entry_point: ReferenceRule) -> None:
+    rules = entry_point.context
+    reachable = {entry_point.symbol}
+    pending = [entry_point.symbol]
+    while pending:
+        rule = rules.get(pending.pop())
+        for reference in [] if rule is None else rule_references(rule):
+            if reference not in reachable:
+                reachable.add(reference)
+                pending.append(reference)
+    for rule_symbol in [s for s in rules if s not in reachable]:
+        del rules[rule_symbol]
+
+
+# level 1 only restructures the rules and keeps every random choice as it was;
+# level 2 also changes how random choices are made, keeping their distribution
+def optimize_rules(entry_point: ReferenceRule, level: int) -> ReferenceRule:
+    rules = entry_point.context
+    if level >= 1:
+        inline_rules(rules)
+        for rule_symbol, rule in rules.items():
+            rules[rule_symbol] = fold_rule(rule)
+        drop_unreachable_rules(entry_point)
+    if level >= 2:
+        tabulate_rules(rules)
+        for rule_symbol, rule in rules.items():
+            rules[rule_symbol] = flatten_alternations(rule)
+    return link_rules(entry_point)
+
+
+# bytecode VM
+class OpCode(enum.Enum):
+    LITERAL         = enum.auto()
+    REGEX           = enum.auto()
+    TABLE           = enum.auto()
+    CALL            = enum.auto()
+    CHOOSE          = enum.auto()
+    CHOOSE_WEIGHTED = enum.auto()
+    OPTIONAL        = enum.auto()
+    REPEAT          = enum.auto()
+    REPEAT_LITERAL  = enum.auto()
+    RETURN          = enum.auto()
+    HALT            = enum.auto()
+    # only in the fast code of a program, see link_fast_code()
+    JUMP            = enum.auto()
+    TAIL_CHOOSE     = enum.auto()
+    LOOP            = enum.auto()
+
+
+type Instruction = tuple[OpCode, object]
+
+# passes the fragments collected by a loop of the VM to the sink as one block
+def flush_fragments(out: list[str], write: Callable[[str], object]) -> None:
+    write(''.join(out))
+    out.clear()
+
+
+@dataclasses.dataclass
+class BytecodeProgram:
+    code: list[Instruction]
+    max_depth: int | None = None
+    target_length: tuple[int, int] | None = None
+    batch_random: bool = False
+    # by CHOOSE address: alternatives that can finish expanding at all,
+    # and those that finish with the least nesting; CHOOSE_WEIGHTED
+    # alternatives come as the same alias tables as their operand
+    terminating_choices: dict[int, tuple] = dataclasses.field(default_factory=dict)
+    shortest_choices: dict[int, tuple] = dataclasses.field(default_factory=dict)
+    # OPTIONAL and REPEAT addresses whose subroutine can never finish expanding
+    unproductive: set[int] = dataclasses.field(default_factory=set)
+    # by CHOOSE address: minimum, expected and maximum lengths and minimum depths of alternatives
+    choice_sizes: dict[int, tuple[tuple[float, ...], ...]] = dataclasses.field(default_factory=dict)
+    # by CHOOSE_WEIGHTED address: weights of alternatives
+    choice_weights: dict[int, tuple[int, ...]] = dataclasses.field(default_factory=dict)
+    # addresses of the subroutines of every rule
+    rule_addresses: dict[str, int] = dataclasses.field(default_factory=dict)
+    # by TABLE address: lengths of the strings in the table
+    table_lengths: dict[int, tuple[int, ...]] = dataclasses.field(default_factory=dict)
+    # lengths of everything from an address until the end of its subroutine
+    tail_min_lengths: list[float] = dataclasses.field(default_factory=list)
+    tail_expected_lengths: list[float] = dataclasses.field(default_factory=list)
+    tail_max_lengths: list[float] = dataclasses.field(default_factory=list)
+    # how much longer than their minimum length they can get
+    tail_slack_lengths: list[float] = dataclasses.field(default_factory=list)
+    # the code run when no choice is steered
+    fast_code: list[Instruction] = dataclasses.field(default_factory=list)
+
+    def gen(self, context: GenerationContext) -> str:
+        out: list[str] = []
+        self.write(context, out.append)
+        return ''.join(out)
+
+    # the VM has one loop for every way of making choices, all laid out alike:
+    # opcodes are bound to locals and dispatched by an if-chain with the most
+    # frequent instructions first; write() and write_batched() run the fast code,
+    # and write_bounded() and write_sized() the plain code, whose frames carry
+    # what their steering needs; a shared loop would have to check the mode on
+    # every instruction, which makes the default one up to a quarter slower
+    #
+    # fragments are passed to the sink in joined blocks of a bounded size, so
+    # memory use is bounded by the depth of the derivation rather than its length
+    def write(self, context: GenerationContext, write: Callable[[str], object]) -> None:
+        if self.target_length is not None:
+            return self.write_sized(context, write)
+        if self.max_depth is not None:
+            return self.write_bounded(context, write)
+        if self.batch_random:
+            return self.write_batched(context, write)
+
+        LITERAL         = OpCode.LITERAL
+        REGEX           = OpCode.REGEX
+        TABLE           = OpCode.TABLE
+        CALL            = OpCode.CALL
+        JUMP            = OpCode.JUMP
+        CHOOSE          = OpCode.CHOOSE
+        TAIL_CHOOSE     = OpCode.TAIL_CHOOSE
+        CHOOSE_WEIGHTED = OpCode.CHOOSE_WEIGHTED
+        OPTIONAL        = OpCode.OPTIONAL
+        REPEAT          = OpCode.REPEAT
+        REPEAT_LITERAL  = OpCode.REPEAT_LITERAL
+        LOOP            = OpCode.LOOP
+        RETURN          = OpCode.RETURN
+
+        code = self.fast_code
+        getrandbits = context.random.getrandbits
+        rng = context.random
+
+        # the sink is called once per block of fragments rather than once per
+        # fragment; any string long enough to fill a block goes through one of
+        # the instructions that check the size of the block
+        out: list[str] = []
+        emit = out.append
+        # return addresses; repetitions return to the LOOP instruction of their REPEAT
+        stack: list[int] = []
+        push = stack.append
+        pop = stack.pop
+        # repetitions left of every repetition in progress, innermost last
+        loops: list[int] = []
+
+        pc = 0
+        while True:
+            op, arg = code[pc]
+            if op is LITERAL:
+                emit(arg)
+                pc += 1
+            elif op is CALL:
+                push(pc + 1)
+                pc = arg
+            elif op is RETURN:
+                pc = pop()
+                if len(out) >= OUTPUT_BUFFER_SIZE:
+                    flush_fragments(out, write)
+            elif op is CHOOSE:
+                # the same numbers as rng.choice() and rng.randint() would draw,
+                # with the number of bits worked out when the code was linked
+                addresses, count, bits = arg
+                picked = getrandbits(bits)
+                while picked >= count:
+                    picked = getrandbits(bits)
+                push(pc + 1)
+                pc = addresses[picked]
+            elif op is JUMP:
+                pc = arg
+                if len(out) >= OUTPUT_BUFFER_SIZE:
+                    flush_fragments(out, write)
+            elif op is TABLE:
+                values, count, bits = arg
+                picked = getrandbits(bits)
+                while picked >= count:
+                    picked = getrandbits(bits)
+                emit(values[picked])
+                pc += 1
+            elif op is TAIL_CHOOSE:
+                addresses, count, bits = arg
+                picked = getrandbits(bits)
+                while picked >= count:
+                    picked = getrandbits(bits)
+                pc = addresses[picked]
+                if len(out) >= OUTPUT_BUFFER_SIZE:
+                    flush_fragments(out, write)
+            elif op is REGEX:
+                emit(arg.sample(rng))
+                pc += 1
+            elif op is LOOP:
+                if loops[-1]:
+                    loops[-1] -= 1
+                    push(pc)
+                    pc = arg[0]
+                else:
+                    loops.pop()
+                    pc = arg[1]
+            elif op is REPEAT:
+                low, width, bits, address, loop = arg
+                times = getrandbits(bits)
+                while times >= width:
+                    times = getrandbits(bits)
+                times += low
+                if times:
+                    loops.append(times - 1)
+                    push(loop)
+                    pc = address
+                else:
+                    pc += 1
+            elif op is REPEAT_LITERAL:
+                low, width, bits, value = arg
+                times = getrandbits(bits)
+                while times >= width:
+                    times = getrandbits(bits)
+                emit(value * (low + times))
+                pc += 1
+            elif op is OPTIONAL:
+                if getrandbits(1):
+                    push(pc + 1)
+                    pc = arg
+                else:
+                    pc += 1
+            elif op is CHOOSE_WEIGHTED:
+                addresses, aliases, thresholds, count, bits, total, total_bits = arg
+                slot = getrandbits(bits)
+                while slot >= count:
+                    slot = getrandbits(bits)
+                coin = getrandbits(total_bits)
+                while coin >= total:
+                    coin = getrandbits(total_bits)
+                push(pc + 1)
+                pc = addresses[slot] if coin < thresholds[slot] else aliases[slot]
+            else:
+                break
+        write(''.join(out))
+
+    # same as write(), but random numbers for choices and repetitions are
+    # taken from words drawn in blocks rather than asked for one at a time
+    def write_batched(self, context: GenerationContext, write: Callable[[str], object]) -> None:
+        LITERAL         = OpCode.LITERAL
+        REGEX           = OpCode.REGEX
+        TABLE           = OpCode.TABLE
+        CALL            = OpCode.CALL
+        JUMP            = OpCode.JUMP
+        CHOOSE          = OpCode.CHOOSE
+        TAIL_CHOOSE     = OpCode.TAIL_CHOOSE
+        CHOOSE_WEIGHTED = OpCode.CHOOSE_WEIGHTED
+        REPEAT          = OpCode.REPEAT
+        REPEAT_LITERAL  = OpCode.REPEAT_LITERAL
+        LOOP            = OpCode.LOOP
+        RETURN          = OpCode.RETURN
+        HALT            = OpCode.HALT
+
+        code = self.fast_code
+        rng = context.random
+        buffer = context.words
+        refill = buffer.refill
+        words = buffer.words
+        position = buffer.position
+        end = len(words)
+
+        # output blocks, return addresses and repetitions left as in write()
+        out: list[str] = []
+        emit = out.append
+        stack: list[int] = []
+        push = stack.append
+        pop = stack.pop
+        loops: list[int] = []
+
+        pc = 0
+        while True:
+            op, arg = code[pc]
+            if op is LITERAL:
+                emit(arg)
+                pc += 1
+            elif op is CALL:
+                push(pc + 1)
+                pc = arg
+            elif op is RETURN:
+                pc = pop()
+                if len(out) >= OUTPUT_BUFFER_SIZE:
+                    flush_fragments(out, write)
+            elif op is JUMP:
+                pc = arg
+                if len(out) >= OUTPUT_BUFFER_SIZE:
+                    flush_fragments(out, write)
+            elif op is REGEX:
+                emit(arg.sample(rng))
+                pc += 1
+            elif op is LOOP:
+                if loops[-1]:
+                    loops[-1] -= 1
+                    push(pc)
+                    pc = arg[0]
+                else:
+                    loops.pop()
+                    pc = arg[1]
+            elif op is HALT:
+                break
+            else:
+                if position == end:
+                    words = refill()
+                    position, end = 0, len(words)
+                # the high bits of a word scaled down to the number of options
+                word = words[position]
+                position += 1
+                if op is CHOOSE:
+                    push(pc + 1)
+                    pc = arg[0][(word * arg[1]) >> 32]
+                elif op is TABLE:
+                    emit(arg[0][(word * arg[1]) >> 32])
+                    pc += 1
+                elif op is TAIL_CHOOSE:
+                    pc = arg[0][(word * arg[1]) >> 32]
+                    if len(out) >= OUTPUT_BUFFER_SIZE:
+                        flush_fragments(out, write)
+                elif op is REPEAT:
+                    low, width, _, address, loop = arg
+                    times = low + ((word * width) >> 32)
+                    if times:
+                        loops.append(times - 1)
+                        push(loop)
+                        pc = address
+                    else:
+                        pc += 1
+                elif op is REPEAT_LITERAL:
+                    low, width, _, value = arg
+                    emit(value * (low + ((word * width) >> 32)))
+                    pc += 1
+                elif op is CHOOSE_WEIGHTED:
+                    push(pc + 1)
+                    addresses, aliases, thresholds, count, _, total, _ = arg
+                    slot = (word * count) >> 32
+                    # the slot is kept or given to its alias by a second word
+                    if position == end:
+                        words = refill()
+                        position, end = 0, len(words)
+                    word = words[position]
+                    position += 1
+                    pc = addresses[slot] if (word * total) >> 32 < thresholds[slot] else aliases[slot]
+                elif word >> 31:
+                    # the rest are OPTIONAL instructions, taken half of the time
+                    push(pc + 1)
+                    pc = arg
+                else:
+                    pc += 1
+        write(''.join(out))
+        buffer.words = words
+        buffer.position = position
+
+    # same as write(), but once rules are nested more than max_depth deep,
+    # counted in rule references like compute_min_depths(), only the choices
+    # that finish expanding the fastest are taken
+    def write_bounded(self, context: GenerationContext, write: Callable[[str], object]) -> None:
+        LITERAL         = OpCode.LITERAL
+        REGEX           = OpCode.REGEX
+        TABLE           = OpCode.TABLE
+        CALL            = OpCode.CALL
+        CHOOSE          = OpCode.CHOOSE
+        CHOOSE_WEIGHTED = OpCode.CHOOSE_WEIGHTED
+        OPTIONAL        = OpCode.OPTIONAL
+        REPEAT          = OpCode.REPEAT
+        REPEAT_LITERAL  = OpCode.REPEAT_LITERAL
+        RETURN          = OpCode.RETURN
+
+        code = self.code
+        max_depth = self.max_depth
+        terminating_choices = self.terminating_choices
+        shortest_choices = self.shortest_choices
+        unproductive = self.unproductive
+        choice = context.random.choice
+        randrange = context.random.randrange
+        randint = context.random.randint
+        getrandbits = context.random.getrandbits
+        rng = context.random
+
+        emit = write
+        # rules being expanded, the entry point included
+        depth = 0
+        # every frame is (return address, repetitions left, subroutine address, depth before the frame)
+        stack: list[tuple[int, int, int, int]] = []
+        push = stack.append
+        pop = stack.pop
+
+        pc = 0
+        while True:
+            op, arg = code[pc]
+            if op is LITERAL:
+                emit(arg)
+                pc += 1
+            elif op is CALL:
+                push((pc + 1, 0, arg, depth))
+                depth += 1
+                pc = arg
+            elif op is RETURN:
+                return_pc, times, address, depth = pop()
+                if times:
+                    push((return_pc, times - 1, address, depth))
+                    pc = address
+                else:
+                    pc = return_pc
+            elif op is CHOOSE:
+                push((pc + 1, 0, 0, depth))
+                if depth > max_depth:
+                    pc = choice(shortest_choices[pc])
+                else:
+                    pc = choice(terminating_choices[pc])
+            elif op is CHOOSE_WEIGHTED:
+                push((pc + 1, 0, 0, depth))
+                if depth > max_depth:
+                    addresses, aliases, thresholds, total = shortest_choices[pc]
+                else:
+                    addresses, aliases, thresholds, total = terminating_choices[pc]
+                slot = randrange(len(addresses))
+                pc = addresses[slot] if randrange(total) < thresholds[slot] else aliases[slot]
+            elif op is TABLE:
+                emit(choice(arg))
+                pc += 1
+            elif op is REGEX:
+                emit(arg.sample(rng))
+                pc += 1
+            elif op is REPEAT:
+                low, high, address = arg
+                if depth > max_depth or pc in unproductive:
+                    times = low
+                else:
+                    times = randint(low, high)
+                if times:
+                    push((pc + 1, times - 1, address, depth))
+                    pc = address
+                else:
+                    pc += 1
+            elif op is REPEAT_LITERAL:
+                low, high, value = arg
+                emit(value * (low if depth > max_depth else randint(low, high)))
+                pc += 1
+            elif op is OPTIONAL:
+                if depth <= max_depth and pc not in unproductive and getrandbits(1):
+                    push((pc + 1, 0, 0, depth))
+                    pc = arg
+                else:
+                    pc += 1
+            else:
+                break
+
+    # same as write(), but every choice is steered toward a randomly picked
+    # length from the target range: the program grows while it is short of
+    # the target and finishes as fast as possible once the budget is spent
+    def write_sized(self, context: GenerationContext, write: Callable[[str], object]) -> None:
+        LITERAL         = OpCode.LITERAL
+        REGEX           = OpCode.REGEX
+        TABLE           = OpCode.TABLE
+        CALL            = OpCode.CALL
+        CHOOSE          = OpCode.CHOOSE
+        CHOOSE_WEIGHTED = OpCode.CHOOSE_WEIGHTED
+        OPTIONAL        = OpCode.OPTIONAL
+        REPEAT          = OpCode.REPEAT
+        REPEAT_LITERAL  = OpCode.REPEAT_LITERAL
+        RETURN          = OpCode.RETURN
+
+        code = self.code
+        max_depth = math.inf if self.max_depth is None else self.max_depth
+        choice_sizes = self.choice_sizes
+        choice_weights = self.choice_weights
+        table_lengths = self.table_lengths
+        tail_min = self.tail_min_lengths
+        tail_expected = self.tail_expected_lengths
+        tail_max = self.tail_max_lengths
+        tail_slack = self.tail_slack_lengths
+        rng = context.random
+        target = rng.randint(*self.target_length)
+
+        emit = write
+        produced = 0
+        # minimum length of everything the frames on the stack still have to
+        # produce, and how much longer than that it can get
+        reserved = 0
+        slack = 0
+        # rules being expanded, counted as in write_bounded()
+        depth = 0
+        # every frame is (return address, repetitions left, subroutine address,
+        # and reserved, slack and depth before the frame)
+        stack: list[tuple[int, int, int, float, float, int]] = []
+        push = stack.append
+        pop = stack.pop
+
+        pc = 0
+        while True:
+            op, arg = code[pc]
+            if op is LITERAL:
+                emit(arg)
+                produced += len(arg)
+                pc += 1
+            elif op is CALL:
+                push((pc + 1, 0, arg, reserved, slack, depth))
+                reserved += tail_min[pc + 1]
+                slack += tail_slack[pc + 1]
+                depth += 1
+                pc = arg
+            elif op is RETURN:
+                return_pc, times, address, reserved, slack, depth = pop()
+                if times:
+                    push((return_pc, times - 1, address, reserved, slack, depth))
+                    reserved += tail_min[return_pc] + (times - 1) * tail_min[address]
+                    slack += tail_slack[return_pc] + (tail_slack[address] * (times - 1) if times > 1 else 0)
+                    pc = address
+                else:
+                    pc = return_pc
+            elif op is REGEX:
+                generated = arg.sample(rng)
+                emit(generated)
+                produced += len(generated)
+                pc += 1
+            else:
+                if depth <= max_depth:
+                    budget = target - produced - reserved - tail_min[pc + 1]
+                    # the part of the budget that nothing after this choice can fill
+                    share = budget - slack - tail_slack[pc + 1]
+                else:
+                    budget = share = 0
+                if op is CHOOSE:
+                    push((pc + 1, 0, 0, reserved, slack, depth))
+                    reserved += tail_min[pc + 1]
+                    slack += tail_slack[pc + 1]
+                    pc = arg[pick_by_length(budget, share, *choice_sizes[pc], rng)]
+                elif op is CHOOSE_WEIGHTED:
+                    push((pc + 1, 0, 0, reserved, slack, depth))
+                    reserved += tail_min[pc + 1]
+                    slack += tail_slack[pc + 1]
+                    pc = arg[0][pick_by_length(budget, share, *choice_sizes[pc], rng, choice_weights[pc])]
+                elif op is REPEAT:
+                    low, high, address = arg
+                    body_min = tail_min[address]
+                    times = pick_repeat_count(
+                        budget, share, low, high, body_min, tail_expected[address], tail_max[address], rng
+                    )
+                    if times:
+                        push((pc + 1, times - 1, address, reserved, slack, depth))
+                        reserved += tail_min[pc + 1] + (times - 1) * body_min
+                        slack += tail_slack[pc + 1] + (tail_slack[address] * (times - 1) if times > 1 else 0)
+                        pc = address
+                    else:
+                        pc += 1
+                elif op is REPEAT_LITERAL:
+                    low, high, value = arg
+                    size = len(value)
+                    times = pick_repeat_count(budget, share, low, high, size, size, size, rng)
+                    emit(value * times)
+                    produced += times * size
+                    pc += 1
+                elif op is TABLE:
+                    # strings of a table are picked like alternatives, so that
+                    # finite parts of the grammar follow the budget as well
+                    lengths = table_lengths[pc]
+                    generated = arg[pick_by_length(budget, share, lengths, lengths, lengths, lengths, rng)]
+                    emit(generated)
+                    produced += len(generated)
+                    pc += 1
+                elif op is OPTIONAL:
+                    taken = pick_by_length(
+                        budget, share, (0, tail_min[arg]), (0, tail_expected[arg]), (0, tail_max[arg]), (0, 1), rng
+                    )
+                    if taken:
+                        push((pc + 1, 0, 0, reserved, slack, depth))
+                        reserved += tail_min[pc + 1]
+                        slack += tail_slack[pc + 1]
+                        pc = arg
+                    else:
+                        pc += 1
+                else:
+                    break
+
+    def bind(self, context: GenerationContext) -> Callable[[], str]:
+        return functools.partial(self.gen, context)
+
+    def __repr__(self) -> str:
+        lines = []
+        for address, (op, arg) in enumerate(self.code):
+            lines.append(f'{address:>6} {op.name:<15} {'' if arg is None else repr(arg)}')
+        return '\n'.join(lines)
+
+    def __str__(self) -> str:
+        return repr(self)
+
+
+def pick_by_length(
+    budget: float,
+    share: float,
+    min_lengths: Sequence[float],
+    expected_lengths: Sequence[float],
+    max_lengths: Sequence[float],
+    depths: Sequence[float],
+    rng: random.Random,
+    weights: Sequence[int] | None = None
+) -> int:
+    options = range(len(min_lengths))
+    feasible = [i for i in options if min_lengths[i] <= budget] if budget > 0 else []
+    if not feasible:
+        # out of budget: finish as fast as possible
+        shortest = min(zip(min_lengths, depths))
+        feasible = [i for i in options if (min_lengths[i], depths[i]) == shortest]
+    elif share > 0:
+        fills = [length_filled(share, expected_lengths[i], max_lengths[i]) for i in feasible]
+        most_filled = max(fills)
+        tilts = [length_tilt(fill, most_filled) for fill in fills]
+        if weights is not None:
+            tilts = [tilt * weights[i] for tilt, i in zip(tilts, feasible)]
+        return rng.choices(feasible, tilts)[0]
+    # whatever is picked, what comes after it can fill the rest
+    if weights is None:
+        return rng.choice(feasible)
+    return rng.choices(feasible, [weights[i] for i in feasible])[0]
+
+
+def pick_repeat_count(
+    budget: float,
+    share: float,
+    low: int,
+    high: int,
+    body_min: float,
+    body_expected: float,
+    body_max: float,
+    rng: random.Random
+) -> int:
+    # the same pick as pick_by_length over every count from low to high, with
+    # n repetitions taking n times the length of one, but the tilt of the counts
+    # is summed up in closed form, so that a large bound costs nothing
+    if budget <= 0 or math.isinf(body_min):
+        most = low - 1 if budget <= 0 or low else 0
+    elif not body_min:
+        most = high
+    else:
+        most = min(high, math.floor(budget / body_min))
+        while most < high and (most + 1) * body_min <= budget:
+            most += 1
+        while most >= 0 and most * body_min > budget:
+            most -= 1
+    if most < low:
+        # out of budget: finish as fast as possible
+        return low
+    elif share <= 0 or not body_max:
+        return rng.randint(low, most)
+    # counts from `first` on can grow long enough to fill the share, and the
+    # ones below it fill n times the expected length of one repetition
+    first = max(low, 1 if math.isinf(body_max) else math.ceil(share / body_max))
+    if first <= most:
+        reaching = most - first + 1
+        most_filled = share
+    else:
+        reaching = 0
+        most_filled = most * body_expected if most else 0
+    if not most_filled:
+        return rng.randint(low, most)
+    # the tilts of the counts below `first` grow with the power LENGTH_TILT of
+    # the count; their sum is taken as the integral of that power from a half
+    # below the lowest to a half above the highest of them
+    power = LENGTH_TILT + 1
+    start = max(low - 0.5, 0)
+    end = min(first, most + 1) - 0.5
+    if end <= start or math.isinf(body_expected):
+        below = 0.0
+    else:
+        below = (body_expected / most_filled) ** LENGTH_TILT * (end ** power - start ** power) / power
+    if rng.random() * (below + reaching) < reaching:
+        return rng.randint(first, most)
+    spot = (start ** power + rng.random() * (end ** power - start ** power)) ** (1 / power)
+    return min(max(round(spot), low), first - 1, most)
+
+
+def length_filled(share: float, expected: float, longest: float) -> float:
+    # how much of its share of the budget, the part that nothing after it can
+    # fill, an option is expected to fill; choices inside the option are
+    # steered in turn, so any option that can grow long enough fills it all
+    return share if longest >= share else expected
+
+
+def length_tilt(filled: float, most_filled: float) -> float:
+    # steered choices keep the probabilities of the grammar for every option
+    # that fills as much of the budget as the best of them, and make options
+    # that fill less of it less likely, rather than always taking the longest
+    if not most_filled:
+        return 1.0
+    return (filled / most_filled) ** LENGTH_TILT
+
+
+def alias_choices(weighted: Iterable[tuple[int, int]]) -> tuple[tuple[int, ...], tuple[int, ...], tuple[int, ...], int]:
+    # (address, weight) pairs as an alias table whose slots and aliases are addresses
+    weighted = list(weighted)
+    addresses = tuple(a for a, _ in weighted)
+    table = AliasTable.from_weights([w for _, w in weighted])
+    return addresses, tuple(addresses[a] for a in table.aliases), table.thresholds, table.total
+
+
+def compile_bytecode(
+    entry_point: ReferenceRule,
+    max_depth: int | None = None,
+    target_length: tuple[int, int] | None = None,
+    batch_random: bool = False
+) -> BytecodeProgram:
+    rules = entry_point.context
+    program = BytecodeProgram([], max_depth, target_length, batch_random)
+    depths: dict[str, float] = {}
+    min_lengths: dict[str, float] = {}
+    expected_lengths: dict[str, float] = {}
+    max_lengths: dict[str, float] = {}
+    if max_depth is not None or target_length is not None:
+        depths = compute_min_depths(rules)
+        if math.isinf(depths[entry_point.symbol]):
+            report_error_and_exit(
+                f'rule <{entry_point.symbol}> can never finish expanding; '
+                'every alternative leads to infinite recursion'
+            )
+    if target_length is not None:
+        min_lengths = compute_min_lengths(rules, expected_regexes=True)
+        expected_lengths = compute_expected_lengths(rules)
+        max_lengths = compute_max_lengths(rules, expected_regexes=True)
+    code: list[Instruction] = [(OpCode.CALL, None), (OpCode.HALT, None)]
+    # rules that produced each instruction, used to size them up
+    nodes: list[Rule | None] = [entry_point, None]
+    rule_addresses: dict[str, int] = {}
+    # (instruction address, symbol) pairs to patch once all rules are laid out
+    unresolved_calls: list[tuple[int, str]] = [(0, entry_point.symbol)]
+    # (instruction address, rules) pairs whose operand needs subroutine addresses
+    pending_subroutines: list[tuple[int, list[Rule]]] = []
+
+    def emit_inline(rule: Rule) -> None:
+        if not isinstance(rule, CompoundRule):
+            nodes.append(rule)
+        if isinstance(rule, LiteralRule):
+            code.append((OpCode.LITERAL, rule.value))
+        elif isinstance(rule, RegexRule):
+            code.append((OpCode.REGEX, rule.sampler))
+        elif isinstance(rule, TableRule):
+            if target_length is not None:
+                program.table_lengths[len(code)] = tuple(len(value) for value in rule.values)
+            code.append((OpCode.TABLE, rule.values))
+        elif isinstance(rule, CompoundRule):
+            for value in rule.values:
+                emit_inline(value)
+        elif isinstance(rule, ReferenceRule):
+            unresolved_calls.append((len(code), rule.symbol))
+            code.append((OpCode.CALL, None))
+        elif isinstance(rule, AlterationRule) and rule.weights is None:
+            pending_subroutines.append((len(code), rule.values))
+            code.append((OpCode.CHOOSE, None))
+        elif isinstance(rule, AlterationRule):
+            program.choice_weights[len(code)] = tuple(rule.weights)
+            pending_subroutines.append((len(code), rule.values))
+            code.append((OpCode.CHOOSE_WEIGHTED, None))
+        elif isinstance(rule, OptionalRule):
+            pending_subroutines.append((len(code), [rule.value]))
+            code.append((OpCode.OPTIONAL, None))
+        elif isinstance(rule, NoneOrMoreRule | OneOrMoreRule | RepeatRule) and isinstance(rule.value, LiteralRule):
+            # repeated literals are written at once, however many repetitions there are
+            code.append((OpCode.REPEAT_LITERAL, (*repeat_bounds(rule), rule.value.value)))
+        elif isinstance(rule, NoneOrMoreRule | OneOrMoreRule | RepeatRule):
+            pending_subroutines.append((len(code), [rule.value]))
+            code.append((OpCode.REPEAT, repeat_bounds(rule)))
+        else:
+            report_error_and_exit(f'cannot compile rule {rule} to bytecode')
+
+    def emit_subroutine(rule: Rule) -> int:
+        address = len(code)
+        emit_inline(rule)
+        code.append((OpCode.RETURN, None))
+        nodes.append(None)
+        return address
+
+    for rule_symbol, rule in rules.items():
+        rule_addresses[rule_symbol] = emit_subroutine(rule)
+
+    def resolve(symbol: str) -> int:
+        address = rule_addresses.get(symbol)
+        if address is None:
+            report_error_and_exit(f'reference to an undefined rule <{symbol}>')
+        return address
+
+    # nested rules become subroutines of their own; references are called directly
+    while pending_subroutines:
+        instruction_address, values = pending_subroutines.pop()
+        addresses: list[int] = []
+        subroutines: dict[int, int] = {}
+        for value in values:
+            if isinstance(value, ReferenceRule):
+                addresses.append(resolve(value.symbol))
+            else:
+                addresses.append(build_once(subroutines, value, emit_subroutine))
+        op, arg = code[instruction_address]
+        weights = program.choice_weights.get(instruction_address)
+        if min_lengths and (op is OpCode.CHOOSE or op is OpCode.CHOOSE_WEIGHTED):
+            program.choice_sizes[instruction_address] = (
+                tuple(rule_min_length(value, min_lengths, expected_regexes=True) for value in values),
+                tuple(rule_expected_length(value, expected_lengths) for value in values),
+                tuple(rule_max_length(value, max_lengths, expected_regexes=True) for value in values),
+                tuple(rule_min_depth(value, depths) for value in values)
+            )
+        if depths:
+            value_depths = [rule_min_depth(value, depths) for value in values]
+            shortest = min(value_depths)
+            if op is OpCode.CHOOSE:
+                program.terminating_choices[instruction_address] = tuple(
+                    a for a, d in zip(addresses, value_depths) if not math.isinf(d)
+                )
+                program.shortest_choices[instruction_address] = tuple(
+                    a for a, d in zip(addresses, value_depths) if d == shortest
+                )
+            elif op is OpCode.CHOOSE_WEIGHTED:
+                program.terminating_choices[instruction_address] = alias_choices(
+                    (a, w) for a, w, d in zip(addresses, weights, value_depths) if not math.isinf(d)
+                )
+                program.shortest_choices[instruction_address] = alias_choices(
+                    (a, w) for a, w, d in zip(addresses, weights, value_depths) if d == shortest
+                )
+            elif math.isinf(shortest):
+                program.unproductive.add(instruction_address)
+        if op is OpCode.CHOOSE:
+            code[instruction_address] = (op, tuple(addresses))
+        elif op is OpCode.CHOOSE_WEIGHTED:
+            code[instruction_address] = (op, alias_choices(zip(addresses, weights)))
+        elif op is OpCode.OPTIONAL:
+            code[instruction_address] = (op, addresses[0])
+        else:
+            code[instruction_address] = (op, (*arg, addresses[0]))
+
+    for instruction_address, symbol in unresolved_calls:
+        code[instruction_address] = (OpCode.CALL, resolve(symbol))
+    program.rule_addresses = rule_addresses
+
+    if min_lengths:
+        program.tail_min_lengths = [0] * len(code)
+        program.tail_expected_lengths = [0] * len(code)
+        program.tail_max_lengths = [0] * len(code)
+        tail_min = tail_expected = tail_max = 0
+        for address in reversed(range(len(code))):
+            node = nodes[address]
+            if node is None:
+                tail_min = tail_expected = tail_max = 0
+            else:
+                tail_min += rule_min_length(node, min_lengths, expected_regexes=True)
+                tail_expected += rule_expected_length(node, expected_lengths)
+                tail_max += rule_max_length(node, max_lengths, expected_regexes=True)
+            program.tail_min_lengths[address] = tail_min
+            program.tail_expected_lengths[address] = tail_expected
+            program.tail_max_lengths[address] = tail_max
+        program.tail_slack_lengths = [
+            high - low if not math.isinf(low) else 0
+            for low, high in zip(program.tail_min_lengths, program.tail_max_lengths)
+        ]
+
+    program.code = code
+    program.fast_code = link_fast_code(code, rule_addresses)
+    return program
+
+
+# instructions that neither call nor jump anywhere
+LEAF_OPCODES = frozenset({OpCode.LITERAL, OpCode.TABLE, OpCode.REGEX, OpCode.REPEAT_LITERAL})
+
+def link_fast_code(code: list[Instruction], rule_addresses: dict[str, int]) -> list[Instruction]:
+    # without steering, the VM only needs frames to know where to return to,
+    # so the code can skip most of them while making the same random choices:
+    # calls of subroutines of a single instruction run it in place, calls and
+    # choices right before a return jump without a frame, choices between
+    # literals pick from a table, subroutines that only jump elsewhere are
+    # skipped, and repetitions count down in a LOOP instruction of their own
+    fast = list(code)
+    for address, ((op, arg), (next_op, _)) in enumerate(itertools.pairwise(code)):
+        if next_op is not OpCode.RETURN:
+            continue
+        elif op is OpCode.CALL:
+            fast[address] = (OpCode.JUMP, arg)
+        elif op is OpCode.CHOOSE:
+            fast[address] = (OpCode.TAIL_CHOOSE, arg)
+
+    symbols = {address: symbol for symbol, address in rule_addresses.items()}
+
+    def target(address: int) -> int:
+        # only calls become jumps, so every jump leads to the subroutine of a rule
+        # and a cycle of jumps is a cycle of rules that are nothing but a reference
+        path: list[int] = []
+        while fast[address][0] is OpCode.JUMP:
+            if address in path:
+                symbol = symbols[min(path[path.index(address):])]
+                report_error_and_exit(f'rule <{symbol}> refers to itself without producing anything')
+            path.append(address)
+            address = fast[address][1]
+        return address
+
+    def leaf(address: int) -> Instruction | None:
+        address = target(address)
+        if fast[address][0] in LEAF_OPCODES and fast[address + 1][0] is OpCode.RETURN:
+            return fast[address]
+        return None
+
+    # the entry call is patched by compile_recursive_rules(), so it stays a call
+    for address, (op, arg) in enumerate(fast[1:], 1):
+        if op is OpCode.CALL or op is OpCode.JUMP:
+            fast[address] = leaf(arg) or (op, target(arg))
+        elif op is OpCode.CHOOSE or op is OpCode.TAIL_CHOOSE:
+            instructions = [leaf(a) for a in arg]
+            if all(instruction is not None and instruction[0] is OpCode.LITERAL for instruction in instructions):
+                # picked with the same random number as the alternative would be
+                fast[address] = (OpCode.TABLE, tuple(value for _, value in instructions))
+            else:
+                fast[address] = (op, tuple(map(target, arg)))
+        elif op is OpCode.CHOOSE_WEIGHTED:
+            addresses, aliases, thresholds, total = arg
+            fast[address] = (op, (tuple(map(target, addresses)), tuple(map(target, aliases)), thresholds, total))
+        elif op is OpCode.OPTIONAL:
+            fast[address] = (op, target(arg))
+        elif op is OpCode.REPEAT:
+            low, high, body = arg
+            fast[address] = (op, (low, high, target(body)))
+
+    # every random pick comes with the number of options and the number of
+    # bits random.Random draws to pick one of them, so that the VM can draw
+    # them itself
+    def options(count: int) -> tuple[int, int]:
+        return count, count.bit_length()
+
+    for address, (op, arg) in enumerate(fast[:len(code)]):
+        if op is OpCode.CHOOSE or op is OpCode.TAIL_CHOOSE or op is OpCode.TABLE:
+            fast[address] = (op, (arg, *options(len(arg))))
+        elif op is OpCode.CHOOSE_WEIGHTED:
+            addresses, aliases, thresholds, total = arg
+            fast[address] = (op, (addresses, aliases, thresholds, *options(len(addresses)), *options(total)))
+        elif op is OpCode.REPEAT:
+            low, high, body = arg
+            fast[address] = (op, (low, *options(high - low + 1), body, len(fast)))
+            fast.append((OpCode.LOOP, (body, address + 1)))
+        elif op is OpCode.REPEAT_LITERAL:
+            low, high, value = arg
+            fast[address] = (op, (low, *options(high - low + 1), value))
+    return fast
+
+
+# flat grammar
+class NodeKind(enum.IntEnum):
+    LITERAL  = enum.auto()
+    REGEX    = enum.auto()
+    SEQUENCE = enum.auto()
+    CHOICE   = enum.auto()
+    WEIGHTED = enum.auto()
+    OPTIONAL = enum.auto()
+    REPEAT   = enum.auto()
+    TABLE    = enum.auto()
+
+
+# the grammar as a few contiguous arrays indexed by node: references point
+# straight at the node of the rule they refer to, and children of every node
+# are a range of the `children` array starting at `firsts[node]`; literals and
+# regexes are nodes that hold an index into the string and regex pools, and
+# tables hold a range of the string pool
+# arrays of a compiled grammar, or views of them in shared memory
+type IntBuffer = array.array | memoryview
+
+@dataclasses.dataclass
+class FlatGrammar:
+    kinds: IntBuffer = dataclasses.field(default_factory=lambda: array.array('B'))
+    firsts: IntBuffer = dataclasses.field(default_factory=lambda: array.array('q'))
+    counts: IntBuffer = dataclasses.field(default_factory=lambda: array.array('q'))
+    # repetition bounds of REPEAT nodes; WEIGHTED choices keep where their alias
+    # table starts in `thresholds` and `aliases` and its total weight instead
+    lows: IntBuffer = dataclasses.field(default_factory=lambda: array.array('q'))
+    highs: IntBuffer = dataclasses.field(default_factory=lambda: array.array('q'))
+    children: IntBuffer = dataclasses.field(default_factory=lambda: array.array('q'))
+    thresholds: IntBuffer = dataclasses.field(default_factory=lambda: array.array('q'))
+    aliases: IntBuffer = dataclasses.field(default_factory=lambda: array.array('q'))
+    strings: list[str] = dataclasses.field(default_factory=list)
+    regexes: list[RegexSampler] = dataclasses.field(default_factory=list)
+    root: int = 0
+
+    def add(self, kind: NodeKind, first: int = 0, count: int = 0, low: int = 0, high: int = 0) -> int:
+        self.kinds.append(kind)
+        self.firsts.append(first)
+        self.counts.append(count)
+        self.lows.append(low)
+        self.highs.append(high)
+        return len(self.kinds) - 1
+
+    def gen(self, context: GenerationContext) -> str:
+        out: list[str] = []
+        self.write(context, out.append)
+        return ''.join(out)
+
+    def write(self, context: GenerationContext, write: Callable[[str], object]) -> None:
+        LITERAL  = NodeKind.LITERAL.value
+        REGEX    = NodeKind.REGEX.value
+        SEQUENCE = NodeKind.SEQUENCE.value
+        CHOICE   = NodeKind.CHOICE.value
+        WEIGHTED = NodeKind.WEIGHTED.value
+        OPTIONAL = NodeKind.OPTIONAL.value
+        TABLE    = NodeKind.TABLE.value
+
+        kinds, firsts, counts, children = self.kinds, self.firsts, self.counts, self.children
+        lows, highs, thresholds, aliases = self.lows, self.highs, self.thresholds, self.aliases
+        strings, regexes = self.strings, self.regexes
+        randrange = context.random.randrange
+        randint = context.random.randint
+        getrandbits = context.random.getrandbits
+        rng = context.random
+
+        emit = write
+        # nodes left to expand, the next one last; children of sequences and
+        # repetitions are pushed all at once rather than kept in frames
+        stack = [self.root]
+        push = stack.append
+        extend = stack.extend
+        pop = stack.pop
+
+        while stack:
+            node = pop()
+            kind = kinds[node]
+            if kind == LITERAL:
+                emit(strings[firsts[node]])
+            elif kind == TABLE:
+                emit(strings[firsts[node] + randrange(counts[node])])
+            elif kind == CHOICE:
+                push(children[firsts[node] + randrange(counts[node])])
+            elif kind == SEQUENCE:
+                first = firsts[node]
+                extend(reversed(children[first:first + counts[node]]))
+            elif kind == WEIGHTED:
+                table = lows[node]
+                slot = randrange(counts[node])
+                if randrange(highs[node]) >= thresholds[table + slot]:
+                    slot = aliases[table + slot]
+                push(children[firsts[node] + slot])
+            elif kind == REGEX:
+                emit(regexes[firsts[node]].sample(rng))
+            elif kind == OPTIONAL:
+                if getrandbits(1):
+                    push(children[firsts[node]])
+            else:
+                times = randint(lows[node], highs[node])
+                child = children[firsts[node]]
+                if kinds[child] == LITERAL:
+                    # repeated literals are written at once
+                    emit(strings[firsts[child]] * times)
+                elif times:
+                    extend([child] * times)
+
+    def bind(self, context: GenerationContext) -> Callable[[], str]:
+        return functools.partial(self.gen, context)
+
+    def __repr__(self) -> str:
+        lines = []
+        for node, kind in enumerate(self.kinds):
+            first, count = self.firsts[node], self.counts[node]
+            if kind == NodeKind.LITERAL:
+                arg = repr(self.strings[first])
+            elif kind == NodeKind.TABLE:
+                arg = ' '.join(repr(value) for value in self.strings[first:first + count])
+            elif kind == NodeKind.REGEX:
+                arg = repr(self.regexes[first].pattern)
+            else:
+                arg = ' '.join(str(child) for child in self.children[first:first + count])
+                if kind == NodeKind.REPEAT:
+                    arg = f'{self.lows[node]}..{self.highs[node]} {arg}'
+                elif kind == NodeKind.WEIGHTED:
+                    table = self.lows[node]
+                    arg = f'{arg} / {self.highs[node]} ' + ' '.join(
+                        f'{threshold}:{alias}' for threshold, alias in zip(
+                            self.thresholds[table:table + count],
+                            self.aliases[table:table + count]
+                        )
+                    )
+            root = ' <- root' if node == self.root else ''
+            lines.append(f'{node:>6} {NodeKind(kind).name:<8} {arg}{root}')
+        return '\n'.join(lines)
+
+    def __str__(self) -> str:
+        return repr(self)
+
+
+def compile_flat(entry_point: ReferenceRule) -> FlatGrammar:
+    rules = entry_point.context
+    grammar = FlatGrammar()
+    literal_nodes: dict[str, int] = {}
+    rule_nodes: dict[str, int] = {}
+    # rules that are nothing but a reference to another rule share its node
+    aliases: dict[str, str] = {}
+    # (position in `children`, symbol) pairs to patch once all rules are laid out
+    unresolved: list[tuple[int, str]] = []
+    alternative_nodes: dict[int, int] = {}
+
+    def add_literal(value: str) -> int:
+        node = literal_nodes.get(value)
+        if node is None:
+            grammar.strings.append(value)
+            node = literal_nodes[value] = grammar.add(NodeKind.LITERAL, len(grammar.strings) - 1)
+        return node
+
+    def add_children(kind: NodeKind, nodes: list[int | str], low: int = 0, high: int = 0) -> int:
+        first = len(grammar.children)
+        for position, child in enumerate(nodes, first):
+            if isinstance(child, str):
+                unresolved.append((position, child))
+                child = -1
+            grammar.children.append(child)
+        return grammar.add(kind, first, len(nodes), low, high)
+
+    def add_child(rule: Rule) -> int | str:
+        if isinstance(rule, ReferenceRule):
+            return rule.symbol
+        return build_once(alternative_nodes, rule, add_rule)
+
+    def add_rule(rule: Rule) -> int:
+        if isinstance(rule, LiteralRule):
+            return add_literal(rule.value)
+        elif isinstance(rule, RegexRule):
+            grammar.regexes.append(rule.sampler)
+            return grammar.add(NodeKind.REGEX, len(grammar.regexes) - 1)
+        elif isinstance(rule, TableRule):
+            first = len(grammar.strings)
+            grammar.strings.extend(rule.values)
+            return grammar.add(NodeKind.TABLE, first, len(rule.values))
+        elif isinstance(rule, CompoundRule):
+            return add_children(NodeKind.SEQUENCE, [add_child(v) for v in rule.values])
+        elif isinstance(rule, AlterationRule) and rule.weights is None:
+            return add_children(NodeKind.CHOICE, [add_child(v) for v in rule.values])
+        elif isinstance(rule, AlterationRule):
+            table = AliasTable.from_weights(rule.weights)
+            if table.total > FLAT_INT_LIMIT:
+                report_error_and_exit(
+                    f'weights adding up to {table.total} are too large for the "flat" engine; '
+                    f'they must add up to at most {FLAT_INT_LIMIT}'
+                )
+            start = len(grammar.thresholds)
+            grammar.thresholds.extend(table.thresholds)
+            grammar.aliases.extend(table.aliases)
+            return add_children(NodeKind.WEIGHTED, [add_child(v) for v in rule.values], start, table.total)
+        elif isinstance(rule, OptionalRule):
+            return add_children(NodeKind.OPTIONAL, [add_child(rule.value)])
+        elif isinstance(rule, NoneOrMoreRule | OneOrMoreRule | RepeatRule):
+            low, high = repeat_bounds(rule)
+            if high > FLAT_INT_LIMIT:
+                report_error_and_exit(
+                    f'repetition bounds {{{low},{high}}} are too large for the "flat" engine; '
+                    f'rules can be repeated at most {FLAT_INT_LIMIT} times'
+                )
+            return add_children(NodeKind.REPEAT, [add_child(rule.value)], low, high)
+        report_error_and_exit(f'cannot compile rule {rule} to a flat grammar')
+
+    for rule_symbol, rule in rules.items():
+        if isinstance(rule, ReferenceRule):
+            aliases[rule_symbol] = rule.symbol
+        else:
+            rule_nodes[rule_symbol] = add_rule(rule)
+
+    def resolve(symbol: str) -> int:
+        seen: set[str] = set()
+        while symbol not in rule_nodes:
+            if symbol not in aliases:
+                report_error_and_exit(f'reference to an undefined rule <{symbol}>')
+            elif symbol in seen:
+                report_error_and_exit(f'rule <{symbol}> refers to itself without producing anything')
+            seen.add(symbol)
+            symbol = aliases[symbol]
+        return rule_nodes[symbol]
+
+    for position, symbol in unresolved:
+        grammar.children[position] = resolve(symbol)
+    grammar.root = resolve(entry_point.symbol)
+    return grammar
+
+
+FLAT_GRAMMAR_ARRAYS = ('kinds', 'firsts', 'counts', 'lows', 'highs', 'children', 'thresholds', 'aliases')
+
+# where the arrays of a flat grammar are in a block of shared memory; this is
+# all a worker process needs to attach to the grammar without copying it
+@dataclasses.dataclass
+class SharedGrammar:
+    name: str
+    # (typecode, offset, length) by array name; literals are stored as one
+    # UTF-8 string split by the `string_ends` array
+    arrays: dict[str, tuple[str, int, int]]
+    strings: tuple[int, int]
+    regexes: list[RegexSampler]
+    root: int
+
+    def attach(self) -> tuple[multiprocessing.shared_memory.SharedMemory, FlatGrammar]:
+        memory = multiprocessing.shared_memory.SharedMemory(self.name)
+        views = {
+            name: memory.buf[offset:offset + length * array.array(typecode).itemsize].cast(typecode)
+            for name, (typecode, offset, length) in self.arrays.items()
+        }
+        offset, size = self.strings
+        encoded = bytes(memory.buf[offset:offset + size])
+        string_ends = views.pop('string_ends')
+        # literals are small compared to the arrays, so every worker decodes its own copy
+        strings = [
+            encoded[start:end].decode()
+            for start, end in zip(itertools.chain((0,), string_ends), string_ends)
+        ]
+        return memory, FlatGrammar(**views, strings=strings, regexes=self.regexes, root=self.root)
+
+
+def share_flat_grammar(grammar: FlatGrammar) -> tuple[multiprocessing.shared_memory.SharedMemory, SharedGrammar]:
+    encoded = [value.encode() for value in grammar.strings]
+    buffers = {name: getattr(grammar, name) for name in FLAT_GRAMMAR_ARRAYS}
+    buffers['string_ends'] = array.array('q', itertools.accumulate(map(len, encoded)))
+    arrays: dict[str, tuple[str, int, int]] = {}
+    size = 0
+    for name, values in buffers.items():
+        # every array starts at an 8-byte boundary
+        size += -size % 8
+        arrays[name] = (values.typecode, size, len(values))
+        size += len(values) * values.itemsize
+    strings_size = sum(map(len, encoded))
+    memory = multiprocessing.shared_memory.SharedMemory(create=True, size=max(1, size + strings_size))
+    for name, values in buffers.items():
+        _, offset, _ = arrays[name]
+        memory.buf[offset:offset + len(values) * values.itemsize] = values.tobytes()
+    memory.buf[size:size + strings_size] = b''.join(encoded)
+    shared = SharedGrammar(memory.name, arrays, (size, strings_size), grammar.regexes, grammar.root)
+    return memory, shared
+
+
+# vectorized generation
+def import_numpy() -> types.ModuleType:
+    # numpy is only needed by the "numpy" engine, so it is imported on demand
+    try:
+        import numpy
+    except ImportError:
+        report_error_and_exit('the "numpy" engine requires numpy to be installed')
+    return numpy
+
+
+def recursive_rules(rules: DictOfRules) -> set[str]:
+    recursive: set[str] = set()
+    for component in strongly_connected_rules(rules):
+        if len(component) > 1 or component[0] in rule_references(rules[component[0]]):
+            recursive.update(component)
+    return recursive
+
+
+def compile_recursive_rules(entry_point: ReferenceRule) -> dict[str, BytecodeProgram]:
+    # programs that start at one of the recursive rules each; the grammar is
+    # compiled once, and they only differ in the first call
+    program = compile_bytecode(entry_point)
+    return {
+        symbol: dataclasses.replace(
+            program,
+            code=[(OpCode.CALL, program.rule_addresses[symbol]), *program.code[1:]],
+            fast_code=[(OpCode.CALL, program.rule_addresses[symbol]), *program.fast_code[1:]]
+        )
+        for symbol in recursive_rules(entry_point.context)
+    }
+
+
+# generates a whole batch of strings at once: every random choice is drawn
+# for all strings of the batch as one array, and the strings are assembled
+# column by column; recursive rules are expanded one string at a time on the
+# bytecode VM, so that their depth is not limited by the python stack
+@dataclasses.dataclass
+class VectorizedGrammar:
+    entry_point: ReferenceRule
+    # by symbol of every recursive rule: a program generating it
+    programs: dict[str, BytecodeProgram]
+
+    def gen(self, context: GenerationContext) -> str:
+        return self.gen_batch(context, 1)[0]
+
+    def gen_batch(self, context: GenerationContext, n: int) -> list[str]:
+        numpy = import_numpy()
+        # the batch draws from its own generator, seeded from the context
+        rng = numpy.random.default_rng(context.random.getrandbits(128))
+        return BatchExpander(numpy, rng, context, self.programs).expand(self.entry_point, n).tolist()
+
+    def bind(self, context: GenerationContext) -> Callable[[], str]:
+        return functools.partial(self.gen, context)
+
+
+@dataclasses.dataclass
+class BatchExpander:
+    numpy: types.ModuleType
+    rng: 'numpy.random.Generator'
+    context: GenerationContext
+    programs: dict[str, BytecodeProgram]
+    # arrays of the values of tables, character classes and alias tables, by the id of their tuple or string
+    arrays: dict[int, 'numpy.ndarray'] = dataclasses.field(default_factory=dict)
+    # arrays of every alternation, by the id of the rule
+    alternations: dict[int, tuple['numpy.ndarray', 'numpy.ndarray | None']] = dataclasses.field(default_factory=dict)
+
+    def expand(self, rule: Rule, n: int) -> 'numpy.ndarray':
+        numpy = self.numpy
+        if isinstance(rule, LiteralRule):
+            return numpy.full(n, rule.value, dtype=object)
+        elif isinstance(rule, TableRule):
+            return self.pick(rule.values, n)
+        elif isinstance(rule, RegexRule):
+            if regex_uses_groups(rule.sampler.program):
+                return self.expand_one_by_one(functools.partial(rule.gen, self.context), n)
+            return self.expand_regex(rule.sampler.program, n)
+        elif isinstance(rule, ReferenceRule):
+            program = self.programs.get(rule.symbol)
+            if program is not None:
+                return self.expand_one_by_one(program.bind(self.context), n)
+            return self.expand(rule.rule, n)
+        elif isinstance(rule, CompoundRule):
+            result = self.expand(rule.values[0], n)
+            for value in rule.values[1:]:
+                result = result + self.expand(value, n)
+            return result
+        elif isinstance(rule, AlterationRule):
+            if rule.table is not None:
+                slots = self.rng.integers(len(rule.values), size=n)
+                coins = self.rng.integers(rule.table.total, size=n)
+                thresholds = self.as_array(rule.table.thresholds, int)
+                aliases = self.as_array(rule.table.aliases, int)
+                choices = numpy.where(coins < thresholds[slots], slots, aliases[slots])
+            else:
+                choices = self.rng.integers(len(rule.values), size=n)
+            canonical, literals = self.alternation_arrays(rule)
+            if literals is not None:
+                return literals[choices]
+            # only the alternatives that were picked are expanded, each for all of its strings at once
+            choices = canonical[choices]
+            order = numpy.argsort(choices, kind='stable')
+            picked, starts, counts = numpy.unique(choices[order], return_index=True, return_counts=True)
+            result = numpy.empty(n, dtype=object)
+            for idx, start, count in zip(picked.tolist(), starts.tolist(), counts.tolist()):
+                result[order[start:start + count]] = self.expand(rule.values[idx], count)
+            return result
+        elif isinstance(rule, OptionalRule):
+            return self.repeat(lambda count: self.expand(rule.value, count), n, 0, 1)
+        elif isinstance(rule, NoneOrMoreRule | OneOrMoreRule | RepeatRule):
+            low, high = repeat_bounds(rule)
+            if isinstance(rule.value, LiteralRule):
+                # every string repeats the literal its own number of times at once
+                return rule.value.value * self.rng.integers(low, high + 1, size=n).astype(object)
+            return self.repeat(lambda count: self.expand(rule.value, count), n, low, high)
+        report_error_and_exit(f'cannot vectorize rule {rule}')
+
+    def expand_one_by_one(self, gen: Callable[[], str], n: int) -> 'numpy.ndarray':
+        result = self.numpy.empty(n, dtype=object)
+        result[:] = [gen() for _ in range(n)]
+        return result
+
+    def expand_regex(self, program: tuple[RegexInstruction, ...], n: int) -> 'numpy.ndarray':
+        result = self.numpy.full(n, '', dtype=object)
+        for op, arg in program:
+            if op is RegexOp.LITERAL:
+                result = result + arg
+            elif op is RegexOp.CHARS:
+                result = result + self.pick(arg, n)
+            elif op is RegexOp.REPEAT_CHARS:
+                low, high, chars = arg
+                result = result + self.repeat(lambda count: self.pick(chars, count), n, low, high)
+            elif op is RegexOp.REPEAT:
+                low, high, body = arg
+                result = result + self.repeat(lambda count: self.expand_regex(body, count), n, low, high)
+            elif op is RegexOp.BRANCH:
+                choices = self.rng.integers(len(arg), size=n)
+                branches = self.numpy.empty(n, dtype=object)
+                for idx, branch in enumerate(arg):
+                    mask = choices == idx
+                    count = int(self.numpy.count_nonzero(mask))
+                    if count:
+                        branches[mask] = self.expand_regex(branch, count)
+                result = result + branches
+        return result
+
+    def repeat(self, expand: Callable[[int], 'numpy.ndarray'], n: int, low: int, high: int) -> 'numpy.ndarray':
+        times = self.rng.integers(low, high + 1, size=n)
+        result = self.numpy.full(n, '', dtype=object)
+        for repetition in range(high):
+            mask = times > repetition
+            count = int(self.numpy.count_nonzero(mask))
+            if not count:
+                break
+            result[mask] = result[mask] + expand(count)
+        return result
+
+    def pick(self, values: tuple[str, ...] | str, n: int) -> 'numpy.ndarray':
+        choices = self.as_array(values)
+        return choices[self.rng.integers(len(choices), size=n)]
+
+    def alternation_arrays(self, rule: AlterationRule) -> tuple['numpy.ndarray', 'numpy.ndarray | None']:
+        # every alternative is mapped to the first index of its value, so that repeated
+        # alternatives are expanded together; alternations of literals are picked
+        # from an array of their strings instead
+        arrays = self.alternations.get(id(rule))
+        if arrays is None:
+            first: dict[int, int] = {}
+            canonical = [
+                build_once(first, value, lambda _, idx=idx: idx)
+                for idx, value in enumerate(rule.values)
+            ]
+            literals = None
+            if all(isinstance(v, LiteralRule) for v in rule.values):
+                literals = self.numpy.array([v.value for v in rule.values], dtype=object)
+            arrays = self.alternations[id(rule)] = (self.numpy.array(canonical), literals)
+        return arrays
+
+    def as_array(self, values: tuple | str, dtype: type = object) -> 'numpy.ndarray':
+        converted = self.arrays.get(id(values))
+        if converted is None:
+            converted = self.arrays[id(values)] = self.numpy.array(list(values), dtype=dtype)
+        return converted
+
+
+def regex_uses_groups(program: tuple[RegexInstruction, ...]) -> bool:
+    for op, arg in program:
+        if op is RegexOp.GROUP or op is RegexOp.GROUPREF:
+            return True
+        elif op is RegexOp.REPEAT and regex_uses_groups(arg[2]):
+            return True
+        elif op is RegexOp.BRANCH and any(regex_uses_groups(branch) for branch in arg):
+            return True
+    return False
+
+
+# uniform sampling
+class CountingKind(enum.Enum):
+    EMPTY     = enum.auto()
+    STRING    = enum.auto()
+    CHARS     = enum.auto()
+    SEQUENCE  = enum.auto()
+    CHOICE    = enum.auto()
+    WEIGHTED  = enum.auto()
+    REFERENCE = enum.auto()
+
+
+# the grammar rewritten as a graph of nodes that each produce either a string,
+# one of a set of characters, a sequence of two nodes, or a choice between
+# nodes; every node keeps the number of its derivations for each length, and
+# an alternative with a weight of w counts as w separate derivations
+@dataclasses.dataclass
+class UniformSampler:
+    kinds: list[CountingKind]
+    args: list[object]
+    root: int
+    target_length: tuple[int, int]
+    counts: list[list[int]] = dataclasses.field(default_factory=list)
+    # lengths with a non-zero number of derivations
+    supports: list[list[int]] = dataclasses.field(default_factory=list)
+    # nodes ordered so that the nodes they depend on come first where possible
+    order: list[int] = dataclasses.field(default_factory=list)
+    # whether nodes of the same length can depend on each other in a cycle
+    cyclic: bool = True
+    # distinct strings of small sub-languages, by node and length
+    languages: dict[tuple[int, int], tuple[str, ...]] = dataclasses.field(default_factory=dict)
+    # number of characters any of the nodes can produce
+    alphabet_size: int = 0
+
+    def count(self, node: int, length: int) -> int:
+        self.extend(length)
+        return self.counts[node][length]
+
+    def extend(self, max_length: int) -> None:
+        if not self.counts:
+            self.counts = [[] for _ in self.kinds]
+            self.supports = [[] for _ in self.kinds]
+            self.order, _ = self.dependency_order(self.children)
+        counts = self.counts
+        for length in range(len(counts[self.root]), max_length + 1):
+            for node_counts in counts:
+                node_counts.append(0)
+            if self.cyclic:
+                self.settle(length)
+            else:
+                for node in self.order:
+                    counts[node][length] = self.count_derivations(node, length)
+            for node, node_counts in enumerate(counts):
+                if node_counts[length]:
+                    self.supports[node].append(length)
+            if length == 0:
+                # now that it is known which nodes can be empty, only keep the
+                # dependencies between nodes of the same length that really exist
+                nullable = [bool(node_counts[0]) for node_counts in counts]
+                self.order, self.cyclic = self.dependency_order(
+                    functools.partial(self.same_length_children, nullable=nullable)
+                )
+
+    def settle(self, length: int) -> None:
+        # derivations that do not consume any characters can make nodes of the
+        # same length depend on each other; when nodes that have derivations of
+        # this length depend on each other in a cycle, going around it gives
+        # infinitely many of them, which is found before counting any
+        derivable = self.derivable(length)
+        nullable = derivable if length == 0 else [bool(node_counts[0]) for node_counts in self.counts]
+
+        def derivable_children(node: int) -> tuple[int, ...]:
+            if not derivable[node]:
+                return ()
+            return tuple(child for child in self.same_length_children(node, nullable) if derivable[child])
+
+        order, cyclic = self.dependency_order(derivable_children)
+        if cyclic:
+            self.report_infinite_derivations(length)
+        # every node now comes after the nodes it depends on, so the counts
+        # settle in one round, and the next one only confirms it
+        order = [node for node in order if derivable[node]]
+        counts = self.counts
+        for _ in range(len(self.kinds) + 1):
+            changed = False
+            for node in order:
+                total = self.count_derivations(node, length)
+                if total != counts[node][length]:
+                    counts[node][length] = total
+                    changed = True
+            if not changed:
+                return
+        self.report_infinite_derivations(length)
+
+    def derivable(self, length: int) -> list[bool]:
+        # whether every node has any derivations of the length, which takes
+        # no counting: a node has some if its parts of the same length do, or
+        # if it is a sequence of two shorter parts that have some
+        kinds, args, counts = self.kinds, self.args, self.counts
+        derivable = [False] * len(kinds)
+        for node, (kind, arg) in enumerate(zip(kinds, args)):
+            if kind is CountingKind.STRING:
+                derivable[node] = len(arg) == length
+            elif kind is CountingKind.CHARS:
+                derivable[node] = length == 1 and bool(arg)
+            elif kind is CountingKind.EMPTY:
+                derivable[node] = length == 0
+            elif kind is CountingKind.SEQUENCE:
+                first, second = arg
+                for first_length in self.supports[first]:
+                    if first_length >= length:
+                        break
+                    elif first_length and counts[second][length - first_length]:
+                        derivable[node] = True
+                        break
+        # parts that can be empty are only known once the length 0 is done
+        nullable = derivable if length == 0 else [bool(node_counts[0]) for node_counts in counts]
+        changed = True
+        while changed:
+            changed = False
+            for node in self.order:
+                kind, arg = kinds[node], args[node]
+                if derivable[node]:
+                    continue
+                elif kind is CountingKind.SEQUENCE:
+                    first, second = arg
+                    found = derivable[first] and nullable[second] or nullable[first] and derivable[second]
+                else:
+                    found = any(derivable[child] for child in self.children(node))
+                if found:
+                    derivable[node] = changed = True
+        return derivable
+
+    def report_infinite_derivations(self, length: int) -> NoReturn:
+        report_error_and_exit(
+            f'grammar has infinitely many derivations of length {length}; '
+            'some rule can expand to itself without producing any characters'
+        )
+
+    def count_derivations(self, node: int, length: int) -> int:
+        kind, arg = self.kinds[node], self.args[node]
+        if kind is CountingKind.STRING:
+            return int(len(arg) == length)
+        elif kind is CountingKind.CHARS:
+            return len(arg) if length == 1 else 0
+        elif kind is CountingKind.EMPTY:
+            return int(length == 0)
+        elif kind is CountingKind.REFERENCE:
+            return self.counts[arg][length]
+        elif kind is CountingKind.CHOICE:
+            return sum(self.counts[child][length] for child in arg)
+        elif kind is CountingKind.WEIGHTED:
+            return sum(weight * self.counts[child][length] for child, weight in zip(*arg))
+        first, second = arg
+        first_counts, second_counts = self.counts[first], self.counts[second]
+        total = 0
+        for first_length in self.supports[first]:
+            if first_length > length:
+                break
+            total += first_counts[first_length] * second_counts[length - first_length]
+        # supports do not include the length being computed yet
+        total += first_counts[length] * second_counts[0]
+        return total
+
+    def dependency_order(self, children_of: Callable[[int], tuple[int, ...]]) -> tuple[list[int], bool]:
+        order: list[int] = []
+        cyclic = False
+        visited = [False] * len(self.kinds)
+        finished = [False] * len(self.kinds)
+        for start in range(len(self.kinds)):
+            if visited[start]:
+                continue
+            visited[start] = True
+            stack = [(start, iter(children_of(start)))]
+            while stack:
+                node, children = stack[-1]
+                child = next(children, None)
+                if child is None:
+                    stack.pop()
+                    order.append(node)
+                    finished[node] = True
+                elif not visited[child]:
+                    visited[child] = True
+                    stack.append((child, iter(children_of(child))))
+                elif not finished[child]:
+                    cyclic = True
+        return order, cyclic
+
+    def same_length_children(self, node: int, nullable: Sequence[bool]) -> tuple[int, ...]:
+        if self.kinds[node] is not CountingKind.SEQUENCE:
+            return self.children(node)
+        first, second = self.args[node]
+        return tuple(child for child, other in ((first, second), (second, first)) if nullable[other])
+
+    def children(self, node: int) -> tuple[int, ...]:
+        kind, arg = self.kinds[node], self.args[node]
+        if kind is CountingKind.REFERENCE:
+            return (arg,)
+        elif kind is CountingKind.CHOICE or kind is CountingKind.SEQUENCE:
+            return tuple(arg)
+        elif kind is CountingKind.WEIGHTED:
+            return arg[0]
+        return ()
+
+    def pick_length(self, rng: random.Random) -> int:
+        low, high = self.target_length
+        self.extend(high)
+        root_counts = self.counts[self.root]
+        total = sum(root_counts[low:high + 1])
+        if not total:
+            report_error_and_exit(f'grammar has no strings of length from {low} to {high}')
+        # every derivation with a length in range is equally likely
+        pick = rng.randrange(total)
+        for length in range(low, high + 1):
+            pick -= root_counts[length]
+            if pick < 0:
+                return length
+        raise AssertionError('unreachable')
+
+    def gen(self, context: GenerationContext) -> str:
+        out: list[str] = []
+        self.write(context, out.append)
+        return ''.join(out)
+
+    def write(self, context: GenerationContext, write: Callable[[str], object]) -> None:
+        kinds, args, counts, supports = self.kinds, self.args, self.counts, self.supports
+        rng = context.random
+        randrange = rng.randrange
+        stack = [(self.root, self.pick_length(rng))]
+        push = stack.append
+        pop = stack.pop
+        while stack:
+            node, length = pop()
+            kind, arg = kinds[node], args[node]
+            if kind is CountingKind.STRING:
+                write(arg)
+            elif kind is CountingKind.CHARS:
+                write(rng.choice(arg))
+            elif kind is CountingKind.REFERENCE:
+                push((arg, length))
+            elif kind is CountingKind.CHOICE:
+                pick = randrange(counts[node][length])
+                for child in arg:
+                    pick -= counts[child][length]
+                    if pick < 0:
+                        push((child, length))
+                        break
+            elif kind is CountingKind.WEIGHTED:
+                pick = randrange(counts[node][length])
+                for child, weight in zip(*arg):
+                    pick -= weight * counts[child][length]
+                    if pick < 0:
+                        push((child, length))
+                        break
+            elif kind is CountingKind.SEQUENCE:
+                first, second = arg
+                first_counts, second_counts = counts[first], counts[second]
+                pick = randrange(counts[node][length])
+                for first_length in supports[first]:
+                    if first_length > length:
+                        break
+                    pick -= first_counts[first_length] * second_counts[length - first_length]
+                    if pick < 0:
+                        break
+                push((second, length - first_length))
+                push((first, first_length))
+
+    def bind(self, context: GenerationContext) -> Callable[[], str]:
+        return functools.partial(self.gen, context)
+
+    def enumerate_language(self) -> Iterator[str]:
+        low, high = self.target_length
+        self.extend(high)
+        alphabet: set[str] = set()
+        for kind, arg in zip(self.kinds, self.args):
+            if kind is CountingKind.STRING or kind is CountingKind.CHARS:
+                alphabet.update(arg)
+        self.alphabet_size = len(alphabet)
+        if self.is_unambiguous():
+            for length in range(low, high + 1):
+                yield from self.derivations(self.root, length)
+            return
+        for length in range(low, high + 1):
+            # ambiguous grammars derive some strings more than once
+            seen: set[str] = set()
+            for value in self.derivations(self.root, length):
+                if value not in seen:
+                    seen.add(value)
+                    yield value
+
+    def is_unambiguous(self) -> bool:
+        # a conservative check that no string within the length bound has two
+        # derivations: no two alternatives of a choice share a string, and every
+        # sequence can be split in only one place; it holds for a node if it
+        # holds for everything the node can reach
+        kinds, args = self.kinds, self.args
+        lengths = [set(support) for support in self.supports]
+        firsts, _, extensions = self.character_sets(lengths)
+        ambiguous: set[int] = set()
+        for node, (kind, arg) in enumerate(zip(kinds, args)):
+            if kind is CountingKind.CHARS:
+                if len(set(arg)) != len(arg):
+                    ambiguous.add(node)
+            elif kind is CountingKind.SEQUENCE:
+                first, second = arg
+                if not self.splits_once(first, second, lengths, firsts, extensions):
+                    ambiguous.add(node)
+            elif kind is CountingKind.CHOICE or kind is CountingKind.WEIGHTED:
+                if not self.disjoint_children(self.children(node), lengths, firsts):
+                    ambiguous.add(node)
+        parents: list[list[int]] = [[] for _ in kinds]
+        for node in range(len(kinds)):
+            for child in self.children(node):
+                parents[child].append(node)
+        stack = list(ambiguous)
+        while stack:
+            for parent in parents[stack.pop()]:
+                if parent not in ambiguous:
+                    ambiguous.add(parent)
+                    stack.append(parent)
+        return self.root not in ambiguous
+
+    def character_sets(self, lengths: list[set[int]]) -> tuple[list[set[str]], list[set[str]], list[set[str]]]:
+        # for every node: the characters its strings can start with, all the
+        # characters of its strings, and the characters that can follow one of
+        # its strings (including the empty one) in a longer string of the node
+        kinds, args = self.kinds, self.args
+        firsts: list[set[str]] = [set() for _ in kinds]
+        chars: list[set[str]] = [set() for _ in kinds]
+        extensions: list[set[str]] = [set() for _ in kinds]
+        for node, (kind, arg) in enumerate(zip(kinds, args)):
+            if kind is CountingKind.STRING and arg:
+                firsts[node].add(arg[0])
+                chars[node].update(arg)
+            elif kind is CountingKind.CHARS:
+                firsts[node].update(arg)
+                chars[node].update(arg)
+        changed = True
+        while changed:
+            changed = False
+            for node in self.order:
+                kind, arg = kinds[node], args[node]
+                size = len(firsts[node]) + len(chars[node]) + len(extensions[node])
+                if kind is CountingKind.SEQUENCE:
+                    first, second = arg
+                    if not lengths[first] or not lengths[second]:
+                        continue
+                    firsts[node] |= firsts[first]
+                    if 0 in lengths[first]:
+                        firsts[node] |= firsts[second]
+                    chars[node] |= chars[first] | chars[second]
+                    if self.splits_once(first, second, lengths, firsts, extensions):
+                        extensions[node] |= extensions[second]
+                        if 0 in lengths[second]:
+                            extensions[node] |= extensions[first]
+                    else:
+                        extensions[node] |= chars[first] | chars[second]
+                else:
+                    children = [child for child in self.children(node) if lengths[child]]
+                    nullable = sum(0 in lengths[child] for child in children)
+                    starts: dict[str, int] = {}
+                    for child in children:
+                        for char in firsts[child]:
+                            starts[char] = starts.get(char, 0) + 1
+                    for child in children:
+                        firsts[node] |= firsts[child]
+                        chars[node] |= chars[child]
+                        extensions[node] |= extensions[child]
+                        # a string of another alternative can continue into a string of this one
+                        if nullable - (0 in lengths[child]):
+                            extensions[node] |= firsts[child]
+                        if any(starts[char] > 1 for char in firsts[child]):
+                            extensions[node] |= chars[child]
+                changed = changed or len(firsts[node]) + len(chars[node]) + len(extensions[node]) != size
+        return firsts, chars, extensions
+
+    def splits_once(
+        self,
+        first: int,
+        second: int,
+        lengths: list[set[int]],
+        firsts: list[set[str]],
+        extensions: list[set[str]]
+    ) -> bool:
+        # a sequence can only be split in one place if one of its parts has a
+        # fixed length, or if no string of the first part continues into a
+        # longer one with a character the second part can start with
+        return (
+            len(lengths[first]) <= 1
+            or len(lengths[second]) <= 1
+            or not extensions[first] & firsts[second]
+        )
+
+    def disjoint_children(self, children: tuple[int, ...], lengths: list[set[int]], firsts: list[set[str]]) -> bool:
+        # two alternatives cannot share a string if their lengths differ, if
+        # they start with different characters, or if they are different literals
+        children = tuple(child for child in children if lengths[child])
+        if sum(0 in lengths[child] for child in children) > 1:
+            return False
+        by_first: dict[str, list[int]] = {}
+        for child in children:
+            for char in firsts[child]:
+                by_first.setdefault(char, []).append(child)
+        for group in by_first.values():
+            literals = [child for child in group if self.kinds[child] is CountingKind.STRING]
+            if len({self.args[child] for child in literals}) != len(literals):
+                return False
+            others = [child for child in group if self.kinds[child] is not CountingKind.STRING]
+            for idx, child in enumerate(others):
+                for other in itertools.chain(others[idx + 1:], literals):
+                    if lengths[child] & lengths[other]:
+                        return False
+        return True
+
+    def derivations(self, node: int, length: int) -> Iterator[str]:
+        count = self.counts[node][length]
+        if not count:
+            return iter(())
+        # the number of distinct strings is bounded by both the number of derivations
+        # and the number of strings of this length over the alphabet
+        elif min(count, self.alphabet_size ** length) > ENUMERATION_MEMO_LIMIT:
+            return self.expand_derivations(node, length)
+        language = self.languages.get((node, length))
+        if language is None:
+            # only distinct strings are kept, so that the same string is not
+            # combined with the rest of the derivation several times
+            language = tuple(dict.fromkeys(self.expand_derivations(node, length)))
+            self.languages[node, length] = language
+        return iter(language)
+
+    def expand_derivations(self, node: int, length: int) -> Iterator[str]:
+        kind, arg = self.kinds[node], self.args[node]
+        if kind is CountingKind.STRING:
+            yield arg
+        elif kind is CountingKind.CHARS:
+            yield from arg
+        elif kind is CountingKind.EMPTY:
+            yield ''
+        elif kind is CountingKind.REFERENCE:
+            yield from self.derivations(arg, length)
+        elif kind is CountingKind.CHOICE:
+            for child in arg:
+                yield from self.derivations(child, length)
+        elif kind is CountingKind.WEIGHTED:
+            # weights only change how likely strings are, not which strings there are
+            for child in arg[0]:
+                yield from self.derivations(child, length)
+        elif kind is CountingKind.SEQUENCE:
+            first, second = arg
+            second_counts = self.counts[second]
+            for first_length in self.supports[first]:
+                if first_length > length:
+                    break
+                if not second_counts[length - first_length]:
+                    continue
+                for head in self.derivations(first, first_length):
+                    for tail in self.derivations(second, length - first_length):
+                        yield head + tail
+
+
+def compile_uniform(entry_point: ReferenceRule, target_length: tuple[int, int]) -> UniformSampler:
+    rules = entry_point.context
+    sampler = UniformSampler([], [], 0, target_length)
+    rule_nodes: dict[str, int] = {}
+    references: list[tuple[int, str]] = []
+    min_lengths = compute_min_lengths(rules)
+
+    def add(kind: CountingKind, arg: object = None) -> int:
+        sampler.kinds.append(kind)
+        sampler.args.append(arg)
+        return len(sampler.kinds) - 1
+
+    def add_sequence(nodes: list[int]) -> int:
+        if not nodes:
+            return add(CountingKind.EMPTY)
+        node = nodes[-1]
+        for previous in reversed(nodes[:-1]):
+            node = add(CountingKind.SEQUENCE, (previous, node))
+        return node
+
+    def add_repeat(node: int, low: int, high: int, shortest: float) -> int:
+        # every number of repetitions is a separate derivation, but more
+        # repetitions of a non-empty value than fit into the longest target
+        # length have none to count; a value that can be empty could be repeated
+        # any number of times, so it is repeated at most as often as there are
+        # characters in the longest target length, which still derives every
+        # string that fits
+        if shortest:
+            high = min(high, int(target_length[1] // shortest))
+        else:
+            high = max(low, min(high, int(target_length[1])))
+        repeats = [add(CountingKind.EMPTY)]
+        if high:
+            repeats.append(node)
+        for _ in range(2, high + 1):
+            repeats.append(add(CountingKind.SEQUENCE, (node, repeats[-1])))
+        return add(CountingKind.CHOICE, tuple(repeats[low:high + 1]))
+
+    def add_regex(items: sre_parse.SubPattern | list) -> int:
+        nodes: list[int] = []
+        for op, av in items:
+            if op in (sre_constants.LITERAL, sre_constants.NOT_LITERAL, sre_constants.ANY, sre_constants.IN):
+                chars = regex_character_class(op, av)
+                kind = CountingKind.STRING if len(chars) == 1 else CountingKind.CHARS
+                nodes.append(add(kind, chars))
+            elif op is sre_constants.BRANCH:
+                nodes.append(add(CountingKind.CHOICE, tuple(add_regex(branch) for branch in av[1])))
+            elif op is sre_constants.SUBPATTERN:
+                nodes.append(add_regex(av[3]))
+            elif op is sre_constants.ATOMIC_GROUP:
+                nodes.append(add_regex(av))
+            elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT, sre_constants.POSSESSIVE_REPEAT):
+                min_times, max_times, sub = av
+                max_times = max(min_times, min(max_times, REGEXP_REPEAT_LIMIT))
+                nodes.append(add_repeat(add_regex(sub), min_times, max_times, sub.getwidth()[0]))
+            elif op is sre_constants.GROUPREF:
+                report_error_and_exit(
+                    'group references in regular expressions are not supported by the uniform engine'
+                )
+            # anchors and lookarounds do not produce characters
+        return add_sequence(nodes)
+
+    def add_rule(rule: Rule) -> int:
+        if isinstance(rule, LiteralRule):
+            return add(CountingKind.STRING, rule.value)
+        elif isinstance(rule, RegexRule):
+            return add_regex(sre_parse.parse(rule.value.pattern, rule.value.flags))
+        elif isinstance(rule, ReferenceRule):
+            node = add(CountingKind.REFERENCE)
+            references.append((node, rule.symbol))
+            return node
+        elif isinstance(rule, CompoundRule):
+            return add_sequence([add_rule(v) for v in rule.values])
+        elif isinstance(rule, AlterationRule) and rule.weights is None:
+            return add(CountingKind.CHOICE, tuple(add_rule(v) for v in rule.values))
+        elif isinstance(rule, AlterationRule):
+            return add(CountingKind.WEIGHTED, (tuple(add_rule(v) for v in rule.values), tuple(rule.weights)))
+        elif isinstance(rule, OptionalRule):
+            return add_repeat(add_rule(rule.value), 0, 1, 0)
+        elif isinstance(rule, NoneOrMoreRule | OneOrMoreRule | RepeatRule):
+            shortest = rule_min_length(rule.value, min_lengths)
+            return add_repeat(add_rule(rule.value), *repeat_bounds(rule), shortest)
+        report_error_and_exit(f'cannot compile rule {rule} for uniform sampling')
+
+    for rule_symbol, rule in rules.items():
+        rule_nodes[rule_symbol] = add_rule(rule)
+    sampler.root = add(CountingKind.REFERENCE)
+    references.append((sampler.root, entry_point.symbol))
+    for node, symbol in references:
+        sampler.args[node] = rule_nodes[symbol]
+    return sampler
+
+
+# python codegen
+def python_identifier(symbol: str, taken: set[str]) -> str:
+    name = 'rule_' + symbol.replace('-', '_')
+    if name in taken:
+        suffix = 1
+        while f'{name}_{suffix}' in taken:
+            suffix += 1
+        name = f'{name}_{suffix}'
+    taken.add(name)
+    return name
+
+
+def compile_python(entry_point: ReferenceRule) -> str:
+    rules = entry_point.context
+    taken: set[str] = set()
+    function_names = {symbol: python_identifier(symbol, taken) for symbol in rules}
+    constants: list[str] = []
+    helpers: list[str] = []
+    callables: dict[int, str] = {}
+
+    def function_name(symbol: str) -> str:
+        name = function_names.get(symbol)
+        if name is None:
+            report_error_and_exit(f'reference to an undefined rule <{symbol}>')
+        return name
+
+    def callable_for(rule: Rule) -> str:
+        if isinstance(rule, ReferenceRule):
+            return function_name(rule.symbol)
+        return build_once(callables, rule, helper_for)
+
+    def helper_for(rule: Rule) -> str:
+        index = len(helpers)
+        helpers.append('')
+        helpers[index] = f'    def _node_{index}():\n        return {expression_for(rule)}\n'
+        return f'_node_{index}'
+
+    def expression_for(rule: Rule) -> str:
+        if isinstance(rule, LiteralRule):
+            return repr(rule.value)
+        elif isinstance(rule, RegexRule):
+            index = len(constants)
+            constants.append(f'    _regex_{index} = context.regex_sampler({rule.value.pattern!r})')
+            return f'_regex_{index}()'
+        elif isinstance(rule, TableRule):
+            index = len(constants)
+            constants.append(f'    _table_{index} = ({', '.join(repr(v) for v in rule.values)})')
+            return f'_choice(_table_{index})'
+        elif isinstance(rule, ReferenceRule):
+            return f'{function_name(rule.symbol)}()'
+        elif isinstance(rule, CompoundRule):
+            # a chain of "+" nests as deep as the sequence is long, which
+            # overflows the stack of the compiler on long sequences
+            return f'\'\'.join(({', '.join(expression_for(v) for v in rule.values)},))'
+        elif isinstance(rule, AlterationRule):
+            index = len(constants)
+            constants.append('')
+            if rule.weights is not None:
+                constants.append(f'    _pick_{index} = context.alias_sampler({tuple(rule.weights)!r})')
+            if all(isinstance(v, LiteralRule) for v in rule.values):
+                constants[index] = f'    _alternatives_{index} = ({', '.join(repr(v.value) for v in rule.values)})'
+                if rule.weights is not None:
+                    return f'_alternatives_{index}[_pick_{index}()]'
+                return f'_choice(_alternatives_{index})'
+            alternatives = [callable_for(v) for v in rule.values]
+            constants[index] = f'    _alternatives_{index} = ({', '.join(alternatives)})'
+            if rule.weights is not None:
+                return f'_alternatives_{index}[_pick_{index}()]()'
+            return f'_choice(_alternatives_{index})()'
+        elif isinstance(rule, OptionalRule):
+            return f'({expression_for(rule.value)} if _getrandbits(1) else \'\')'
+        elif isinstance(rule, NoneOrMoreRule | OneOrMoreRule | RepeatRule):
+            low, high = repeat_bounds(rule)
+            if isinstance(rule.value, LiteralRule):
+                return f'({rule.value.value!r} * _randint({low}, {high}))'
+            return f'\'\'.join([{expression_for(rule.value)} for _ in range(_randint({low}, {high}))])'
+        report_error_and_exit(f'cannot compile rule {rule} to python')
+
+    functions = [
+        f'    def {function_names[symbol]}():  # <{symbol}>\n        return {expression_for(rule)}\n'
+        for symbol, rule in rules.items()
+    ]
+
+    lines = [
+        '# generated by pybnfuzzer; do not edit',
+        '#',
+        '# usage:',
+        '#     generate = make_generator(pybnfuzzer.GenerationContext.from_seed(42))',
+        '#     generate()',
+    ]
+    lines += [
+        '',
+        '',
+        'def make_generator(context):',
+        '    _choice = context.random.choice',
+        '    _randint = context.random.randint',
+        '    _getrandbits = context.random.getrandbits',
+        '',
+        *functions,
+        *helpers,
+        *constants,
+        '',
+        f'    return {function_name(entry_point.symbol)}',
+        '',
+        '',
+        'def gen(context):',
+        '    return make_generator(context)()',
+        '',
+    ]
+    return '\n'.join(lines)
+
+
+@dataclasses.dataclass
+class PythonProgram:
+    source: str
+    module: types.ModuleType
+
+    def gen(self, context: GenerationContext) -> str:
+        return self.module.gen(context)
+
+    def bind(self, context: GenerationContext) -> Callable[[], str]:
+        return self.module.make_generator(context)
+
+    # modules cannot be pickled, so the program is rebuilt from its source
+    def __reduce__(self) -> tuple[Callable[[str], 'PythonProgram'], tuple[str]]:
+        return load_python, (self.source,)
+
+
+def load_python(source: str) -> PythonProgram:
+    module = types.ModuleType('pybnfuzzer_grammar')
+    exec(compile(source, module.__name__, 'exec'), module.__dict__)
+    return PythonProgram(source, module)
+
+
+# generation
+type Engine = ReferenceRule | BytecodeProgram | FlatGrammar | VectorizedGrammar | PythonProgram | UniformSampler
+
+ENGINES = ('vm', 'flat', 'tree', 'python', 'numpy', 'uniform')
+
+@dataclasses.dataclass
+class EngineOptions:
+    engine: str = 'vm'
+    max_depth: int | None = None
+    recursion_limit: int | None = None
+    target_length: tuple[int, int] | None = None
+    optimization_level: int = 2
+    batch_random: bool = False
+    star_limit: int = START_LIMIT
+    plus_limit: int = PLUS_LIMIT
+
+
+def build_engine(entry_point: ReferenceRule, options: EngineOptions) -> Engine:
+    engine = options.engine
+    if options.max_depth is not None and engine != 'vm':
+        report_error_and_exit(f'--max-depth is not supported by the "{engine}" engine')
+    if options.target_length is not None and engine not in ('vm', 'uniform'):
+        report_error_and_exit(f'--target-length is not supported by the "{engine}" engine')
+    if options.batch_random and engine != 'vm':
+        report_error_and_exit(f'--batch-random is not supported by the "{engine}" engine')
+    elif options.batch_random and (options.max_depth is not None or options.target_length is not None):
+        report_error_and_exit('--batch-random cannot be combined with --max-depth or --target-length')
+    entry_point = limit_repetitions(entry_point, options.star_limit, options.plus_limit)
+    if engine == 'uniform':
+        if options.target_length is None:
+            report_error_and_exit('the "uniform" engine requires --target-length or --length-range')
+        # repeated alternatives and tables would count as separate derivations
+        entry_point = optimize_rules(entry_point, min(options.optimization_level, 1))
+        sampler = compile_uniform(entry_point, options.target_length)
+        sampler.extend(options.target_length[1])
+        return sampler
+    entry_point = optimize_rules(entry_point, options.optimization_level)
+    if engine == 'vm':
+        return compile_bytecode(entry_point, options.max_depth, options.target_length, options.batch_random)
+    elif engine == 'flat':
+        return compile_flat(entry_point)
+    elif engine == 'python':
+        return load_python(compile_python(entry_point))
+    elif engine == 'numpy':
+        import_numpy()
+        return VectorizedGrammar(entry_point, compile_recursive_rules(entry_point))
+    elif engine == 'tree':
+        return entry_point
+    report_error_and_exit(f'unknown engine "{engine}"')
+
+
+# cache
+def default_cache_dir() -> str:
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'pybnfuzzer')
+
+
+@functools.cache
+def program_fingerprint() -> bytes:
+    # compiled engines are only valid for the exact code that built them
+    with open(__file__, 'rb') as f:
+        return hashlib.sha256(f.read()).digest()
+
+
+def engine_cache_key(grammar_digest: bytes, options: EngineOptions) -> str:
+    key = hashlib.sha256(program_fingerprint())
+    key.update(sys.version.encode())
+    # the recursion limit is applied when generating, not when compiling
+    key.update(repr(dataclasses.replace(options, recursion_limit=None)).encode())
+    key.update(grammar_digest)
+    return key.hexdigest()
+
+
+def hashed_chunks(chunks: Iterable[str], digest: 'hashlib._Hash') -> Iterator[str]:
+    for chunk in chunks:
+        digest.update(chunk.encode())
+        yield chunk
+
+
+def load_cached_engine(path: str) -> Engine | None:
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # unreadable entries are rebuilt and overwritten
+        return None
+
+
+def store_cached_engine(path: str, engine: Engine) -> None:
+    cache_dir = os.path.dirname(path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile('wb', dir=cache_dir, suffix='.tmp', delete=False) as f:
+            temporary_path = f.name
+            try:
+                pickle.dump(engine, f, pickle.HIGHEST_PROTOCOL)
+            except (pickle.PicklingError, RecursionError):
+                # very deep grammars are not cached
+                f.close()
+                os.remove(temporary_path)
+                return
+        # concurrent runs may store the same entry, the last one wins
+        os.replace(temporary_path, path)
+    except OSError:
+        pass
+
+
+def load_engine(f: TextIO, options: EngineOptions, cache_dir: str | None = None) -> Engine:
+    if cache_dir is None:
+        return build_engine(parse_bnf_chunks(read_chunks(f)), options)
+    digest = hashlib.sha256()
+    entry_point = None
+    if f.seekable():
+        # hashing the grammar first lets a cache hit skip parsing altogether
+        for chunk in hashed_chunks(read_chunks(f), digest):
+            pass
+        f.seek(0)
+    else:
+        # the grammar can only be read once, so it is hashed while being parsed
+        entry_point = parse_bnf_chunks(hashed_chunks(read_chunks(f), digest))
+    path = os.path.join(cache_dir, f'{engine_cache_key(digest.digest(), options)}.pickle')
+    engine = load_cached_engine(path)
+    if engine is None:
+        if entry_point is None:
+            entry_point = parse_bnf_chunks(read_chunks(f))
+        engine = build_engine(entry_point, options)
+        store_cached_engine(path, engine)
+    return engine
+
+
+def generate_many(generator: Engine, context: GenerationContext, n: int) -> Iterator[str]:
+    gen = generator.bind(context)
+    for _ in range(n):
+        yield gen()
+
+
+def write_many(
+    generator: Engine,
+    context: GenerationContext,
+    n: int,
+    separator: str,
+    write: Callable[[str], object]
+) -> None:
+    if isinstance(generator, BytecodeProgram | FlatGrammar | UniformSampler):
+        for idx in range(n):
+            if idx:
+                write(separator)
+            generator.write(context, write)
+        return
+    elif isinstance(generator, VectorizedGrammar):
+        write_strings(iter(generator.gen_batch(context, n)), separator, write)
+        return
+    write_strings(generate_many(generator, context, n), separator, write)
+
+
+def write_strings(strings: Iterator[str], separator: str, write: Callable[[str], object]) -> None:
+    for idx, generated in enumerate(strings):
+        if idx:
+            write(separator)
+        write(generated)
+
+
+SHARD_SIZE = 1000
+
+_worker_engine: Engine | None = None
+# shared memory the engine of a worker is a view of, kept open for as long as the worker lives
+_worker_memory: multiprocessing.shared_memory.SharedMemory | None = None
+
+def init_generation_worker(engine: Engine | SharedGrammar, options: EngineOptions) -> None:
+    global _worker_engine, _worker_memory
+    if options.recursion_limit and options.engine in ('tree', 'python', 'numpy'):
+        sys.setrecursionlimit(options.recursion_limit)
+    if isinstance(engine, SharedGrammar):
+        _worker_memory, engine = engine.attach()
+    _worker_engine = engine
+
+
+def write_shard(seed: int, shard: int, count: int, separator: str, write: Callable[[str], object]) -> None:
+    # every shard gets its own seed, so the output does not depend on
+    # how shards are distributed between workers
+    context = GenerationContext.from_seed(f'{seed}:{shard}')
+    write_many(_worker_engine, context, count, separator, write)
+
+
+def generate_shard(seed: int, shard: int, count: int, separator: str) -> str:
+    out: list[str] = []
+    write_shard(seed, shard, count, separator, out.append)
+    return ''.join(out)
+
+
+def write_corpus(
+    engine: Engine,
+    options: EngineOptions,
+    count: int,
+    seed: int,
+    write: Callable[[str], object],
+    jobs: int = 1,
+    separator: str = '\n'
+) -> None:
+    shard_counts = [min(SHARD_SIZE, count - start) for start in range(0, count, SHARD_SIZE)]
+    shards = range(len(shard_counts))
+    if jobs == 1:
+        init_generation_worker(engine, options)
+        for shard, shard_count in zip(shards, shard_counts):
+            if shard:
+                write(separator)
+            write_shard(seed, shard, shard_count, separator, write)
+        return
+
+    # workers get the compiled engine instead of parsing the grammar again;
+    # flat grammars are not even copied, every worker attaches to the same shared memory
+    memory = None
+    shared: Engine | SharedGrammar = engine
+    if isinstance(engine, FlatGrammar):
+        memory, shared = share_flat_grammar(engine)
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            jobs,
+            initializer=init_generation_worker,
+            initargs=(shared, options)
+        ) as executor:
+            generated_shards = executor.map(
+                generate_shard, itertools.repeat(seed), shards, shard_counts, itertools.repeat(separator)
+            )
+            for shard, generated in enumerate(generated_shards):
+                if shard:
+                    write(separator)
+                write(generated)
+    finally:
+        if memory is not None:
+            memory.close()
+            memory.unlink()
+
+
+def parse_length_range(value: str) -> tuple[int, int]:
+    low, sep, high = value.partition(',')
+    try:
+        length_range = (int(low), int(high)) if sep else (int(low), int(low))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid length range: "{value}"')
+    if length_range[0] < 0 or length_range[0] > length_range[1]:
+        raise argparse.ArgumentTypeError(f'invalid length range: "{value}"')
+    return length_range
+
+
+def parse_job_count(value: str) -> int:
+    try:
+        jobs = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid number of jobs: "{value}"')
+    if jobs < 0:
+        raise argparse.ArgumentTypeError(f'invalid number of jobs: "{value}"')
+    return jobs
+
+
+def unescape_separator(separator: str) -> str:
+    escapes = {'n': '\n', 't': '\t', 'r': '\r', '0': '\0', '\\': '\\'}
+    return re.sub(r'\\(.)', lambda m: escapes.get(m[1], m[0]), separator)
 
 
 def main() -> None:
@@ -538,10 +3832,140 @@ def main() -> None:
         help='file to write generated strings to; by default, outputs results to stdout',
         metavar='<file>'
     )
+    parser.add_argument(
+        '-e', '--engine',
+        choices=ENGINES,
+        default='vm',
+        help=
+            'generation engine to use: "vm" runs the grammar compiled to bytecode '
+            'on an iterative VM, "flat" runs the grammar laid out in flat arrays of nodes, '
+            '"tree" walks the parsed rules recursively, '
+            '"python" compiles the grammar to python functions, "numpy" generates '
+            'strings in batches with numpy arrays, "uniform" picks '
+            'uniformly among all derivations of the --target-length; the default is "vm"'
+    )
+    parser.add_argument(
+        '-n', '--count',
+        type=int,
+        help=
+            'number of strings to generate; the default is 1, or every string '
+            'when used with --enumerate',
+        metavar='<n>'
+    )
+    parser.add_argument(
+        '--separator',
+        default='\\n',
+        type=unescape_separator,
+        help=
+            'string written between generated strings; "\\n", "\\t", "\\r", "\\0" '
+            'and "\\\\" escapes are recognized; the default is "\\n"',
+        metavar='<string>'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=parse_job_count,
+        default=1,
+        help=
+            'number of worker processes to generate strings with; 0 uses all available '
+            'CPU cores; the output does not depend on the number of jobs; the default is 1',
+        metavar='<n>'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        help='seed for the random number generator; by default, a random seed is used',
+        metavar='<n>'
+    )
+    parser.add_argument(
+        '-d', '--max-depth',
+        type=int,
+        help=
+            'number of nested rule references after which the "vm" engine only takes the '
+            'choices that finish expanding the fastest, so that every string is generated in '
+            'finite time; it does not limit the length of strings, which can grow quickly '
+            'with the depth; unlimited by default',
+        metavar='<n>'
+    )
+    length_group = parser.add_mutually_exclusive_group()
+    length_group.add_argument(
+        '-t', '--target-length',
+        type=parse_length_range,
+        help=
+            'steer the "vm" engine toward generating strings of about <n> characters; '
+            'the "uniform" engine generates strings of exactly <n> characters',
+        metavar='<n>'
+    )
+    length_group.add_argument(
+        '--length-range',
+        type=parse_length_range,
+        dest='target_length',
+        help=
+            'like --target-length, but the target of every string is picked '
+            'at random from <min> to <max> characters',
+        metavar='<min>,<max>'
+    )
+    parser.add_argument(
+        '--enumerate',
+        action='store_true',
+        help=
+            'if set, will write every distinct string of the grammar with a length '
+            'within --target-length or --length-range, shortest first, '
+            'instead of random strings'
+    )
+    parser.add_argument(
+        '--batch-random',
+        action='store_true',
+        help=
+            'if set, the "vm" engine draws random numbers in blocks instead of one at a time, '
+            'which is faster but changes the output for a given seed'
+    )
+    parser.add_argument(
+        '--star-limit',
+        type=int,
+        default=START_LIMIT,
+        help=f'maximum number of repetitions of rules marked with "*"; the default is {START_LIMIT}',
+        metavar='<n>'
+    )
+    parser.add_argument(
+        '--plus-limit',
+        type=int,
+        default=PLUS_LIMIT,
+        help=f'maximum number of repetitions of rules marked with "+"; the default is {PLUS_LIMIT}',
+        metavar='<n>'
+    )
+    parser.add_argument(
+        '-O', '--optimization-level',
+        type=int,
+        choices=(0, 1, 2),
+        default=2,
+        help=
+            'how much to optimize the grammar before generation: 0 disables optimization, '
+            '1 inlines small rules, joins literals and drops unused rules, '
+            '2 also precomputes finite parts of the grammar and merges nested alternatives, '
+            'which keeps the distribution of strings but changes the output for a given seed; '
+            'the default is 2',
+        metavar='<level>'
+    )
+    parser.add_argument(
+        '--cache-dir',
+        help=
+            'directory to keep compiled grammars in, so that later runs with the same '
+            'grammar and options skip parsing and compilation; the default is '
+            '"$XDG_CACHE_HOME/pybnfuzzer" or "~/.cache/pybnfuzzer"',
+        metavar='<dir>'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='if set, will neither read compiled grammars from the cache nor store them there'
+    )
     parser.add_argument(
         '-r', '--recursion',
         type=int,
-        help=f'change recursion depth limit; the default is {sys.getrecursionlimit()}',
+        help=
+            'change recursion depth limit of the "tree" and "python" engines, and of '
+            'the nesting of non-recursive rules in the "numpy" engine, which expands '
+            f'recursive rules on the VM; the default is {sys.getrecursionlimit()}',
         metavar='<n>'
     )
     parser.add_argument(
@@ -551,6 +3975,14 @@ def main() -> None:
             'if set, will emit parsed AST of the provided BNF grammar '
             'instead of a generated string; useful for debugging'
     )
+    parser.add_argument(
+        '--emit-python',
+        action='store_true',
+        help=
+            'if set, will emit a python module compiled from the provided BNF grammar '
+            'instead of a generated string; the module can be imported later and '
+            'exposes a gen() function'
+    )
 
     # a workaround to add another option that behaves like a help message
     # without complaining that a required positional argument was not provided
@@ -561,20 +3993,44 @@ def main() -> None:
 
     args = parser.parse_args()
 
-    if args.recursion:
-        sys.setrecursionlimit(args.recursion)
-
-    with args.file as f:
-        bnf = f.read()
-
-    ast_entry_point = parse_bnf(bnf)
-
-    with args.output as f:
+    with args.file as grammar_file, args.output as f:
         if args.emit_ast:
-            f.write(repr(ast_entry_point))
+            entry_point = parse_bnf_chunks(read_chunks(grammar_file))
+            entry_point = limit_repetitions(entry_point, args.star_limit, args.plus_limit)
+            f.write(repr(optimize_rules(entry_point, args.optimization_level)))
+        elif args.emit_python:
+            entry_point = parse_bnf_chunks(read_chunks(grammar_file))
+            entry_point = limit_repetitions(entry_point, args.star_limit, args.plus_limit)
+            f.write(compile_python(optimize_rules(entry_point, args.optimization_level)))
+        elif args.enumerate:
+            if args.target_length is None:
+                report_error_and_exit('--enumerate requires --target-length or --length-range')
+            try:
+                entry_point = parse_bnf_chunks(read_chunks(grammar_file))
+                entry_point = limit_repetitions(entry_point, args.star_limit, args.plus_limit)
+                entry_point = optimize_rules(entry_point, min(args.optimization_level, 1))
+                strings = compile_uniform(entry_point, args.target_length).enumerate_language()
+                write_strings(itertools.islice(strings, args.count), args.separator, f.write)
+            except RecursionError:
+                report_error_and_exit('maximum recursion depth exceeded')
         else:
+            options = EngineOptions(
+                args.engine,
+                args.max_depth,
+                args.recursion,
+                args.target_length,
+                args.optimization_level,
+                args.batch_random,
+                args.star_limit,
+                args.plus_limit
+            )
+            seed = args.seed if args.seed is not None else random.randrange(2 ** 64)
+            jobs = args.jobs or os.cpu_count() or 1
+            count = args.count if args.count is not None else 1
+            cache_dir = None if args.no_cache else args.cache_dir or default_cache_dir()
             try:
-                f.write(ast_entry_point.gen())
+                engine = load_engine(grammar_file, options, cache_dir)
+                write_corpus(engine, options, count, seed, f.write, jobs, args.separator)
             except RecursionError:
                 report_error_and_exit('maximum recursion depth exceeded')
             except Exception as e:
@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+from typing import Callable
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+SCRIPT = os.path.join(os.path.dirname(__file__), '..', 'pybnfuzzer.py')
+EXAMPLES = os.path.join(os.path.dirname(__file__), '..', 'examples')
+
+# generous for a grammar of a few rules, but a run that takes longer hangs
+RUN_TIMEOUT = 30
+
+
+@pytest.fixture
+def run(tmp_path) -> Callable[..., subprocess.CompletedProcess]:
+    # runs the command line on a grammar, given as text or as a path to a file
+    def run(grammar: str, *args: str) -> subprocess.CompletedProcess:
+        if not os.path.exists(grammar):
+            path = tmp_path / 'grammar.bnf'
+            path.write_text(grammar)
+            grammar = str(path)
+        return subprocess.run(
+            [sys.executable, SCRIPT, grammar, '--no-cache', *args],
+            capture_output=True,
+            text=True,
+            timeout=RUN_TIMEOUT
+        )
+
+    return run
@@ -0,0 +1,83 @@
+import io
+import os
+import subprocess
+import sys
+
+import pytest
+
+import pybnfuzzer
+from conftest import RUN_TIMEOUT, SCRIPT
+
+GRAMMAR = '<start> ::= "a" <start> | /[0-9]{1,3}/ ;\n'
+
+
+@pytest.fixture
+def cached(tmp_path):
+    # runs the command line with the cache kept in a directory of the test
+    grammar_path = tmp_path / 'grammar.bnf'
+    grammar_path.write_text(GRAMMAR)
+    cache_home = tmp_path / 'cache'
+
+    def cached(*args: str, grammar: str = GRAMMAR) -> subprocess.CompletedProcess:
+        grammar_path.write_text(grammar)
+        return subprocess.run(
+            [sys.executable, SCRIPT, str(grammar_path), '--seed', '3', '-n', '20', *args],
+            capture_output=True,
+            text=True,
+            timeout=RUN_TIMEOUT,
+            env={**os.environ, 'XDG_CACHE_HOME': str(cache_home)}
+        )
+
+    return cached
+
+
+def entries(tmp_path) -> list[str]:
+    return sorted(os.listdir(tmp_path / 'cache' / 'pybnfuzzer'))
+
+
+def test_cache_is_on_by_default(cached, tmp_path):
+    first = cached()
+    assert first.returncode == 0, first.stdout + first.stderr
+    assert len(entries(tmp_path)) == 1
+    second = cached()
+    assert second.stdout == first.stdout
+    assert len(entries(tmp_path)) == 1
+
+
+def test_cache_entries_depend_on_grammar_and_options(cached, tmp_path):
+    cached()
+    cached(grammar=GRAMMAR.replace('"a"', '"b"'))
+    assert len(entries(tmp_path)) == 2
+    cached('-O', '0')
+    assert len(entries(tmp_path)) == 3
+    # the recursion limit is applied when generating, so it shares the entry
+    cached('-r', '50')
+    assert len(entries(tmp_path)) == 3
+
+
+def test_no_cache_leaves_the_cache_alone(cached, tmp_path):
+    result = cached('--no-cache')
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert not (tmp_path / 'cache').exists()
+
+
+def test_broken_entry_is_rebuilt(cached, tmp_path):
+    first = cached()
+    entry = tmp_path / 'cache' / 'pybnfuzzer' / entries(tmp_path)[0]
+    entry.write_bytes(b'not a pickle')
+    second = cached()
+    assert second.returncode == 0, second.stdout + second.stderr
+    assert second.stdout == first.stdout
+    assert entry.read_bytes() != b'not a pickle'
+
+
+def test_cache_hit_skips_parsing(tmp_path, monkeypatch):
+    options = pybnfuzzer.EngineOptions()
+    pybnfuzzer.load_engine(io.StringIO(GRAMMAR), options, str(tmp_path))
+
+    def parse(chunks):
+        raise AssertionError('the grammar was parsed again')
+
+    monkeypatch.setattr(pybnfuzzer, 'parse_bnf_chunks', parse)
+    engine = pybnfuzzer.load_engine(io.StringIO(GRAMMAR), options, str(tmp_path))
+    assert engine is not None
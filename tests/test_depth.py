@@ -0,0 +1,25 @@
+import pytest
+
+# every "(" is one more reference to <start>, so the nesting of the parentheses
+# is the depth of the rules
+NESTED = '<start> ::= "(" <start> ")" | "x" ;\n'
+
+
+@pytest.mark.parametrize('depth', [0, 1, 4])
+def test_max_depth_counts_rule_references(run, depth):
+    result = run(NESTED, '-d', str(depth), '--seed', '3', '-n', '300')
+    assert result.returncode == 0, result.stdout
+    nesting = [s.count('(') for s in result.stdout.split('\n')]
+    assert max(nesting) == depth
+
+
+def test_max_depth_combines_with_target_length(run):
+    result = run(NESTED, '-d', '2', '-t', '20', '--seed', '3', '-n', '50')
+    assert result.returncode == 0, result.stdout
+    assert max(s.count('(') for s in result.stdout.split('\n')) <= 2
+
+
+def test_rule_that_never_finishes_is_reported(run):
+    result = run('<start> ::= "a" <start> ;\n', '-d', '3')
+    assert result.returncode == 1
+    assert 'rule <start> can never finish expanding' in result.stdout
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from conftest import EXAMPLES
+
+# weights, regexes, repetitions with and without bounds, optionals, and recursion
+# that stops with probability one
+MIXED = '''
+<start>  ::= <item> <items>{0,3} ;
+<items>  ::= ", " <item> ;
+<item>   ::= 3: <word> | <number> | "(" <list>? ")" ;
+<list>   ::= <word> | <word> " " <list> ;
+<word>   ::= /[a-z]{1,4}/ | "x"+ | 'y'* ;
+<number> ::= /-?[0-9]+/ | 2: "0" | "1" "0"{2} ;
+'''
+
+GRAMMARS = {
+    'mixed': MIXED,
+    'postal': os.path.join(EXAMPLES, 'postal.bnf'),
+}
+
+# engines that draw from the same random generator in the same order
+ENGINES = ['vm', 'flat', 'tree', 'python']
+
+
+@pytest.mark.parametrize('level', ['0', '1', '2'])
+@pytest.mark.parametrize('grammar', GRAMMARS)
+def test_same_seed_same_output(run, grammar, level):
+    outputs = {}
+    for engine in ENGINES:
+        result = run(GRAMMARS[grammar], '-e', engine, '-O', level, '--seed', '42', '-n', '50')
+        assert result.returncode == 0, result.stdout + result.stderr
+        outputs[engine] = result.stdout
+    assert outputs['vm'], 'nothing was generated'
+    for engine in ENGINES[1:]:
+        assert outputs[engine] == outputs['vm'], engine
+
+
+@pytest.mark.parametrize('level', ['0', '1', '2'])
+def test_optimization_keeps_language(run, level):
+    # every level draws differently, but all of them stay within the language
+    result = run('<start> ::= "a" <start> "b" | 3: "" ;\n', '-O', level, '--seed', '7', '-n', '200')
+    assert result.returncode == 0, result.stdout
+    for string in result.stdout.split('\n'):
+        half = len(string) // 2
+        assert string == 'a' * half + 'b' * half
+
+
+@pytest.mark.parametrize('grammar', GRAMMARS)
+def test_batch_random_is_deterministic(run, grammar):
+    first = run(GRAMMARS[grammar], '--batch-random', '--seed', '42', '-n', '50')
+    second = run(GRAMMARS[grammar], '--batch-random', '--seed', '42', '-n', '50')
+    assert first.returncode == 0, first.stdout + first.stderr
+    assert first.stdout == second.stdout
+    # the choices are drawn differently, so the strings differ from the plain vm
+    plain = run(GRAMMARS[grammar], '--seed', '42', '-n', '50')
+    assert first.stdout != plain.stdout
+
+
+def test_batch_random_keeps_language(run):
+    result = run('<start> ::= "a" <start> "b" | 3: "" ;\n', '--batch-random', '--seed', '7', '-n', '200')
+    assert result.returncode == 0, result.stdout
+    strings = result.stdout.split('\n')
+    for string in strings:
+        half = len(string) // 2
+        assert string == 'a' * half + 'b' * half
+    assert len(set(strings)) > 1
+
+
+@pytest.mark.parametrize('grammar, symbol', [
+    ('<start> ::= <start> ;', 'start'),
+    ('<start> ::= "x" | <a> ;\n<a> ::= <b> ;\n<b> ::= <a> ;', 'a'),
+])
+def test_reference_cycle_is_reported(run, grammar, symbol):
+    result = run(grammar + '\n', '-e', 'vm')
+    assert result.returncode == 1
+    assert f'rule <{symbol}> refers to itself without producing anything' in result.stdout
@@ -0,0 +1,57 @@
+import itertools
+import re
+
+import pytest
+
+
+def balanced(string: str) -> bool:
+    depth = 0
+    for char in string:
+        depth += 1 if char == '(' else -1
+        if depth < 0:
+            return False
+    return depth == 0
+
+
+# grammar, alphabet, membership test, and the longest strings to enumerate;
+# ambiguous grammars check that every string is written once
+CASES = {
+    'balanced': ('<start> ::= "" | "(" <start> ")" <start> ;', '()', balanced, 8),
+    'ambiguous': ('<start> ::= "a" | <start> "a" | "a" <start> ;', 'ab', re.compile('a+').fullmatch, 6),
+    'modifiers': (
+        '<start> ::= "a"{1,2} "b"? /[ab]/ "c"* ;',
+        'abc',
+        re.compile('a{1,2}b?[ab]c{0,5}').fullmatch,
+        6
+    ),
+    'weighted': ('<start> ::= 3: "ab" | "b" <start> ;', 'ab', re.compile('b*ab').fullmatch, 7),
+    'nested': (
+        '<start> ::= "a" <start> "b" | <end> ;\n<end> ::= "" | "c" ;',
+        'abc',
+        lambda s: re.fullmatch('a*c?b*', s) is not None and s.count('a') == s.count('b'),
+        6
+    ),
+}
+
+
+@pytest.mark.parametrize('case', CASES)
+def test_enumerate_matches_brute_force(run, case):
+    grammar, alphabet, member, longest = CASES[case]
+    expected = {
+        string
+        for length in range(longest + 1)
+        for string in map(''.join, itertools.product(alphabet, repeat=length))
+        if member(string)
+    }
+    result = run(grammar + '\n', '--enumerate', '--length-range', f'0,{longest}')
+    assert result.returncode == 0, result.stdout
+    strings = result.stdout.split('\n')
+    assert len(strings) == len(set(strings))
+    assert set(strings) == expected
+    assert [len(s) for s in strings] == sorted(len(s) for s in strings)
+
+
+def test_enumerate_single_length(run):
+    result = run('<start> ::= /[ab]{2}/ | "c"{1,3} ;\n', '--enumerate', '-t', '2')
+    assert result.returncode == 0, result.stdout
+    assert sorted(result.stdout.split('\n')) == ['aa', 'ab', 'ba', 'bb', 'cc']
@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+from conftest import EXAMPLES
+
+POSTAL = os.path.join(EXAMPLES, 'postal.bnf')
+
+
+@pytest.mark.parametrize('jobs', ['2', '3'])
+def test_output_does_not_depend_on_jobs(run, jobs):
+    single = run(POSTAL, '--seed', '5', '-n', '40')
+    parallel = run(POSTAL, '--seed', '5', '-n', '40', '-j', jobs)
+    assert single.returncode == 0 and parallel.returncode == 0, parallel.stdout + parallel.stderr
+    assert parallel.stdout == single.stdout
+
+
+@pytest.mark.parametrize('jobs', ['1', '3'])
+def test_flat_grammar_in_shared_memory(run, jobs):
+    # with several jobs the workers read the arrays of the grammar from shared memory
+    vm = run(POSTAL, '--seed', '5', '-n', '40')
+    flat = run(POSTAL, '-e', 'flat', '--seed', '5', '-n', '40', '-j', jobs)
+    assert flat.returncode == 0, flat.stdout + flat.stderr
+    assert flat.stdout == vm.stdout
+
+
+@pytest.mark.parametrize('grammar, message', [
+    ('<start> ::= "a"{0,99999999999999999999} ;', 'repetition bounds {0,99999999999999999999} are too large'),
+    ('<start> ::= 99999999999999999999: "a" | "b" ;', 'weights adding up to 100000000000000000000 are too large'),
+])
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_numbers_too_large_for_flat_arrays(run, grammar, message, jobs):
+    result = run(grammar + '\n', '-e', 'flat', '-j', jobs)
+    assert result.returncode == 1
+    assert message in result.stdout
+    assert 'Traceback' not in result.stderr
+
+
+@pytest.mark.parametrize('jobs', ['-1', 'two'])
+def test_invalid_job_count_is_a_usage_error(run, jobs):
+    result = run(POSTAL, '-j', jobs)
+    assert result.returncode == 2
+    assert f'invalid number of jobs: "{jobs}"' in result.stderr
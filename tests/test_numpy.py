@@ -0,0 +1,50 @@
+import os
+import re
+
+import pytest
+
+from conftest import EXAMPLES
+
+pytest.importorskip('numpy')
+
+# regexes, repetitions, optionals and weights are expanded column by column,
+# and <nest> is recursive, so it runs on the VM
+GRAMMAR = '''
+<start> ::= <word> <more>{0,3} "."? ;
+<more>  ::= "-" <word> ;
+<word>  ::= 2: /[a-c]{1,3}/ | "x"+ | <nest> ;
+<nest>  ::= "(" <nest> ")" | "y" ;
+'''
+
+WORD = r'(?:[a-c]{1,3}|x{1,5}|\(*y\)*)'
+LANGUAGE = re.compile(rf'{WORD}(?:-{WORD}){{0,3}}\.?')
+
+
+def generate(run, *args: str) -> list[str]:
+    result = run(GRAMMAR, '-e', 'numpy', '-n', '2500', *args)
+    assert result.returncode == 0, result.stdout + result.stderr
+    return result.stdout.split('\n')
+
+
+def test_numpy_keeps_language(run):
+    strings = generate(run, '--seed', '3')
+    assert len(strings) == 2500
+    for string in strings:
+        assert LANGUAGE.fullmatch(string), string
+        for word in string.rstrip('.').split('-'):
+            assert word.count('(') == word.count(')'), string
+    # every part of the grammar is reached
+    assert any('(' in s for s in strings) and any('x' in s for s in strings) and any(s.endswith('.') for s in strings)
+
+
+def test_numpy_is_deterministic(run):
+    assert generate(run, '--seed', '3') == generate(run, '--seed', '3')
+    assert generate(run, '--seed', '3') != generate(run, '--seed', '4')
+
+
+def test_numpy_with_jobs(run):
+    postal = os.path.join(EXAMPLES, 'postal.bnf')
+    single = run(postal, '-e', 'numpy', '--seed', '5', '-n', '3000')
+    parallel = run(postal, '-e', 'numpy', '--seed', '5', '-n', '3000', '-j', '2')
+    assert single.returncode == 0 and parallel.returncode == 0, parallel.stdout + parallel.stderr
+    assert parallel.stdout == single.stdout
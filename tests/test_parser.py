@@ -0,0 +1,49 @@
+import pytest
+
+import pybnfuzzer
+
+ERRORS = [
+    ('<rule> ::= "a" ;', 'could not find an entry point; grammar must contain a <start> rule'),
+    ('<start> ::= "a" | ;', 'empty alteration variant in rule <start>'),
+    ('<start> ::= <missing> ;', 'reference to an undefined rule <missing>'),
+    ('<start> ::= "a" ; <start> ::= "b" ;', 'attempt to redefine existing rule "start"'),
+    ('<start> ::= "a"', 'missing semicolon for rule definition'),
+    ('<start> ::= "a ;', 'unterminated literal value near "a ;'),
+    ('<start> ::= "a" & ;', 'unrecognized symbol: "&" (code: 38)'),
+]
+
+
+@pytest.mark.parametrize('grammar, message', ERRORS)
+def test_error_message(run, grammar, message):
+    result = run(grammar + '\n')
+    assert result.returncode == 1
+    assert message in result.stdout
+    assert 'Traceback' not in result.stderr
+
+
+# every kind of token, with escapes, comments and whitespace in between, so that
+# some chunk boundary falls inside each of them
+TOKENS = '''# a comment
+<start> ::= "x\\\\y" <item>* | 'z\\n'+ /[a-c]{2}'// ;
+<item>  ::= 12 : ( "a" | <start> )? "b"{ 1 , 3 } | 3:<long-name_2> ;
+<long-name_2> ::= "" ;
+'''
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 8])
+def test_chunks_of_any_size_lex_the_same(size):
+    chunks = [TOKENS[idx:idx + size] for idx in range(0, len(TOKENS), size)]
+    assert list(pybnfuzzer.lex_bnf_chunks(chunks)) == pybnfuzzer.lex_bnf(TOKENS)
+
+
+def test_every_split_lexes_the_same():
+    tokens = pybnfuzzer.lex_bnf(TOKENS)
+    for idx in range(len(TOKENS) + 1):
+        chunks = [TOKENS[:idx], TOKENS[idx:]]
+        assert list(pybnfuzzer.lex_bnf_chunks(chunks)) == tokens, idx
+
+
+def test_error_in_last_chunk_is_reported(capsys):
+    with pytest.raises(SystemExit):
+        list(pybnfuzzer.lex_bnf_chunks(['<start> ::= "a', 'b ;']))
+    assert 'unterminated literal value near "ab ;' in capsys.readouterr().out
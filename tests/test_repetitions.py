@@ -0,0 +1,36 @@
+import importlib.util
+import re
+
+import pytest
+
+ENGINES = ['vm', 'flat', 'tree', 'python']
+if importlib.util.find_spec('numpy') is not None:
+    ENGINES.append('numpy')
+
+BOUNDED = '<start> ::= "a"{2,4} <b>{3} "-" <b>* "-" "c"+ ;\n<b> ::= "b" | "d" ;\n'
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_repetitions_stay_within_bounds(run, engine):
+    result = run(BOUNDED, '-e', engine, '--seed', '2', '-n', '300', '--star-limit', '2', '--plus-limit', '3')
+    assert result.returncode == 0, result.stdout + result.stderr
+    strings = result.stdout.split('\n')
+    for string in strings:
+        assert re.fullmatch('a{2,4}[bd]{3}-[bd]{0,2}-c{1,3}', string), string
+    # every count within the bounds is drawn
+    assert {len(s) - len(s.lstrip('a')) for s in strings} == {2, 3, 4}
+    assert {len(s) - len(s.rstrip('c')) for s in strings} == {1, 2, 3}
+
+
+@pytest.mark.parametrize('grammar, message', [
+    ('<start> ::= "a"{3,1} ;', 'repetition bounds {3,1} in rule <start> are in the wrong order'),
+    ('<start> ::= {2} ;', 'nothing to repeat in rule <start>'),
+    ('<start> ::= * "a" ;', 'nothing to repeat in rule <start>'),
+    ('<start> ::= "a" | ? ;', 'nothing to make optional in rule <start>'),
+    ('<start> ::= "a"{2,} ;', 'malformed repetition bounds near "{2,}"'),
+])
+def test_bounds_error_message(run, grammar, message):
+    result = run(grammar + '\n')
+    assert result.returncode == 1
+    assert message in result.stdout
+    assert 'Traceback' not in result.stderr
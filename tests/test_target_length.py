@@ -0,0 +1,58 @@
+import collections
+import os
+
+import pytest
+
+from conftest import EXAMPLES
+
+# every rule can stop or recurse, and nothing but the steering decides how long
+# a string gets
+EXPRESSIONS = '''
+<start> ::= <expr> ;
+<expr>  ::= <term> | <expr> "-" <term> | <expr> "+" <term> ;
+<term>  ::= <atom> | <term> "*" <atom> ;
+<atom>  ::= "r" | "s" | "u" | "(" <expr> ")" | "-" <atom> ;
+'''
+
+# the longest word is always the longest option, so steering that only ever
+# takes the longest option writes the same string every time
+WORDS = '''
+<start> ::= <word> " " <start> | <word> ;
+<word>  ::= "a" | "bc" | "def" ;
+'''
+
+BRAINF = os.path.join(EXAMPLES, 'brainf.bnf')
+POSTAL = os.path.join(EXAMPLES, 'postal.bnf')
+
+
+def generate(run, grammar: str, target: int) -> list[str]:
+    result = run(grammar, '-t', str(target), '--seed', '11', '-n', '50', '--separator', '\\0')
+    assert result.returncode == 0, result.stdout + result.stderr
+    return result.stdout.split('\0')
+
+
+@pytest.mark.parametrize('grammar, target', [
+    (EXPRESSIONS, 10),
+    (EXPRESSIONS, 60),
+    (WORDS, 40),
+    (BRAINF, 300),
+    (POSTAL, 200),
+])
+def test_target_length_is_hit(run, grammar, target):
+    strings = generate(run, grammar, target)
+    hits = sum(abs(len(s) - target) <= max(1, target // 10) for s in strings)
+    assert hits >= 0.9 * len(strings)
+
+
+@pytest.mark.parametrize('grammar, target, prefix', [
+    (EXPRESSIONS, 10, 4),
+    (EXPRESSIONS, 60, 6),
+    (WORDS, 40, 8),
+    (BRAINF, 300, 30),
+])
+def test_steered_strings_differ_in_shape(run, grammar, target, prefix):
+    # none of the grammars has regexes, so the same start means the same choices
+    strings = generate(run, grammar, target)
+    prefixes = collections.Counter(s[:prefix] for s in strings)
+    assert prefixes.most_common(1)[0][1] <= len(strings) // 5
+    assert len(set(strings)) == len(strings)
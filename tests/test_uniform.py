@@ -0,0 +1,28 @@
+import pytest
+
+# a nullable cycle through a repetition: <start> derives itself without
+# producing any characters, so it has infinitely many derivations
+NULLABLE_CYCLE = '<start> ::= <start>+ | "b"* ;\n'
+
+
+@pytest.mark.parametrize('args', [('-e', 'uniform', '-t', '3'), ('--enumerate', '-t', '3')])
+def test_nullable_cycle_is_reported(run, args):
+    result = run(NULLABLE_CYCLE, *args)
+    assert result.returncode == 1
+    assert 'infinitely many derivations' in result.stdout
+
+
+def test_bounded_repetition_of_nullable_rule_is_finite(run):
+    # every repetition of <a> can be empty, but there are only so many of them
+    result = run('<start> ::= <a>* "x" ;\n<a> ::= "" | "y" ;\n', '--enumerate', '--length-range', '0,3')
+    assert result.returncode == 0, result.stdout
+    assert result.stdout.split('\n') == ['x', 'yx', 'yyx']
+
+
+@pytest.mark.parametrize('args', [('-e', 'uniform', '-n', '20'), ('--enumerate',)])
+def test_large_repetition_of_nullable_rule_is_capped(run, args):
+    # the repetitions are only counted as far as the target length needs them
+    grammar = '<start> ::= <a>{0,10000000} "x" ;\n<a> ::= "" | "y" ;\n'
+    result = run(grammar, '--length-range', '0,3', *args)
+    assert result.returncode == 0, result.stdout
+    assert set(result.stdout.split('\n')) <= {'x', 'yx', 'yyx'}
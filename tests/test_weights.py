@@ -0,0 +1,83 @@
+import collections
+import fractions
+import importlib.util
+
+import pytest
+
+import pybnfuzzer
+
+WEIGHTED = '<start> ::= 3: "a" | "b" | 4: <c> ;\n<c> ::= "c" ;\n'
+
+ENGINES = ['vm', 'flat', 'tree', 'python']
+if importlib.util.find_spec('numpy') is not None:
+    ENGINES.append('numpy')
+
+
+def frequencies(run, grammar: str, n: int, *args: str) -> dict[str, float]:
+    result = run(grammar, '--seed', '1', '-n', str(n), *args)
+    assert result.returncode == 0, result.stdout + result.stderr
+    counts = collections.Counter(result.stdout.split('\n'))
+    return {string: count / n for string, count in counts.items()}
+
+
+@pytest.mark.parametrize('args', [
+    *(('-e', engine) for engine in ENGINES),
+    ('--batch-random',),
+    ('-O', '0'),
+    # every variant counts as as many derivations as its weight
+    ('-e', 'uniform', '-t', '1'),
+])
+def test_variants_follow_their_weights(run, args):
+    shares = frequencies(run, WEIGHTED, 8000, *args)
+    assert shares.keys() == {'a', 'b', 'c'}
+    for string, weight in [('a', 3), ('b', 1), ('c', 4)]:
+        assert shares[string] == pytest.approx(weight / 8, abs=0.025), string
+
+
+def test_weights_survive_merged_alternatives(run):
+    # -O2 merges the alternation of <ab> into the one of <start> and scales its weights
+    grammar = '<start> ::= 2: <ab> | "c" ;\n<ab> ::= "a" | 3: "b" ;\n'
+    shares = frequencies(run, grammar, 8000, '-O', '2')
+    for string, share in [('a', 2 / 12), ('b', 6 / 12), ('c', 4 / 12)]:
+        assert shares[string] == pytest.approx(share, abs=0.025), string
+
+
+@pytest.mark.parametrize('grammar, message', [
+    ('<start> ::= 0: "a" | "b" ;', 'weights must be positive; got 0 in rule <start>'),
+    ('<start> ::= 3 "a" | "b" ;', 'missing ":" after the weight 3'),
+])
+def test_weight_error_message(run, grammar, message):
+    result = run(grammar + '\n')
+    assert result.returncode == 1
+    assert message in result.stdout
+    assert 'Traceback' not in result.stderr
+
+
+@pytest.mark.parametrize('weights', [
+    [1],
+    [1, 1],
+    [3, 1],
+    [1, 2, 3, 4, 5],
+    [1000, 1, 1, 1],
+    [idx * 37 % 50 + 1 for idx in range(300)],
+])
+def test_alias_table_keeps_weights(weights):
+    # every slot is picked with the same probability, then kept with the
+    # probability of its threshold or given to its alias otherwise
+    table = pybnfuzzer.AliasTable.from_weights(weights)
+    size = len(weights)
+    assert len(table.thresholds) == len(table.aliases) == size
+    shares = [fractions.Fraction(0)] * size
+    for slot, (threshold, alias) in enumerate(zip(table.thresholds, table.aliases)):
+        kept = fractions.Fraction(threshold, table.total)
+        shares[slot] += kept / size
+        shares[alias] += (1 - kept) / size
+    assert shares == [fractions.Fraction(weight, sum(weights)) for weight in weights]
+
+
+def test_large_alternation_follows_its_weights(run):
+    # one heavy variant among a thousand light ones
+    variants = ' | '.join(['1000: "heavy"', *(f'"v{idx}"' for idx in range(1000))])
+    shares = frequencies(run, f'<start> ::= {variants} ;\n', 10000)
+    assert shares['heavy'] == pytest.approx(0.5, abs=0.025)
+    assert len(shares) > 900